@@ -0,0 +1,215 @@
+import json
+import logging
+import math
+import operator
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+from timeseries import HOUR_FORMAT, floor_hour
+
+logger = logging.getLogger(__name__)
+
+OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+RULE_TYPES = ('threshold', 'silence')
+
+DEFAULT_RULES = [
+    {'name': 'aqi_unhealthy', 'type': 'threshold', 'op': '>', 'value': 150, 'for_hours': 3},
+    {'name': 'device_silent', 'type': 'silence', 'for_hours': 2}
+]
+
+
+class Rule:
+    """A condition that fires once it has held for ``for_hours`` consecutive closed hours
+
+    ``threshold`` rules compare the hour's AQI with ``value``; an hour without
+    a reading breaks the run. ``silence`` rules hold for hours without a
+    reading, whether the upstream reported the sensor offline or sent nothing.
+    """
+
+    def __init__(self, name, type, for_hours=1, op='>', value=None, description=None):
+        if type not in RULE_TYPES:
+            raise ValueError(f"Rule '{name}': type must be one of {', '.join(RULE_TYPES)}")
+        if type == 'threshold' and (op not in OPERATORS or not isinstance(value, (int, float))):
+            raise ValueError(f"Rule '{name}': threshold rules need an op ({', '.join(OPERATORS)}) and a numeric value")
+        if not isinstance(for_hours, int) or for_hours < 1:
+            raise ValueError(f"Rule '{name}': for_hours must be a positive integer")
+
+        self.name = name
+        self.type = type
+        self.for_hours = for_hours
+        self.op = op
+        self.value = value
+        self.description = description or (
+            f"AQI {op} {value} for {for_hours}h" if type == 'threshold' else f"No reading for {for_hours}h"
+        )
+
+    def matches(self, aqi):
+        """Whether an hour's AQI (NaN for no reading) counts toward the rule"""
+        if self.type == 'silence':
+            return math.isnan(aqi)
+        return not math.isnan(aqi) and OPERATORS[self.op](aqi, self.value)
+
+    def to_dict(self):
+        rule = {'name': self.name, 'type': self.type, 'for_hours': self.for_hours, 'description': self.description}
+        if self.type == 'threshold':
+            rule.update(op=self.op, value=self.value)
+        return rule
+
+
+def load_rules(path=None):
+    """Rules from a JSON file holding a list of rule objects, or DEFAULT_RULES if there is no file"""
+    if path and os.path.exists(path):
+        with open(path, 'r') as f:
+            config = json.load(f)
+    else:
+        config = DEFAULT_RULES
+    return [Rule(**rule) for rule in config]
+
+
+class LogSink:
+    def send(self, event):
+        logger.warning("Alert %s %s for %s at %s: %s", event['rule'], event['state'],
+                       event['mac'], event['hour'], event['description'])
+
+
+class WebhookSink:
+    """POSTs each event as JSON from a background thread so evaluation never waits on the receiver"""
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='alert-webhook')
+
+    def send(self, event):
+        self.executor.submit(self._post, event)
+
+    def _post(self, event):
+        try:
+            self.session.post(self.url, json=event, timeout=self.timeout).raise_for_status()
+        except Exception as e:
+            logger.warning("Alert webhook %s failed: %s", self.url, e)
+
+
+class AlertEngine:
+    """Evaluates alert rules incrementally as closed hours are ingested
+
+    Per device it keeps the last evaluated hour and, per rule, the length of
+    the current run and whether the rule is firing. ``update`` reads only the
+    hours closed since the previous call, so each new hour costs O(1) per
+    rule no matter how much history is stored. An hour still stored as
+    provisional holds evaluation back until it is fetched again as final. An event is sent when a rule
+    starts firing and again when it resolves.
+
+    State lives in memory in the process that ingests; after a restart each
+    device is re-evaluated from its last ``lookback`` hours.
+    """
+
+    def __init__(self, rules, sinks, recent=200):
+        self.rules = rules
+        self.sinks = sinks
+        self.lookback = max((rule.for_hours for rule in rules), default=0)
+
+        self._devices = {}
+        self._recent = deque(maxlen=recent)
+        self._lock = threading.Lock()
+
+    def _state(self, mac):
+        key = mac.lower()
+        with self._lock:
+            state = self._devices.get(key)
+            if state is None:
+                state = self._devices[key] = {
+                    'mac': mac,
+                    'last_hour': None,
+                    'runs': [0] * len(self.rules),
+                    'firing': [None] * len(self.rules)
+                }
+        return state
+
+    def update(self, mac, history, now=None):
+        """Evaluate the hours of a device that closed since the last update
+
+        Calls for one device must not overlap; the ingestion scheduler
+        never polls a device twice at once.
+        """
+        if not self.rules:
+            return
+        state = self._state(mac)
+        last_closed = floor_hour(now or datetime.now()) - timedelta(hours=1)
+        first = state['last_hour'] + timedelta(hours=1) if state['last_hour'] else last_closed - timedelta(hours=self.lookback - 1)
+        if first > last_closed:
+            return
+        # A value stored before its hour closed may still change; stop short of it until it is final
+        provisional = history.first_provisional_hour(mac, first, last_closed)
+        if provisional is not None:
+            last_closed = provisional - timedelta(hours=1)
+            if first > last_closed:
+                return
+
+        hours, values = history.read_range(mac, first, last_closed)
+        expected = first
+        for hour, aqi in zip(hours.astype(datetime), values):
+            if hour > expected:
+                # Hours missing from the store had no reading
+                self._advance(state, expected, hour - timedelta(hours=1), math.nan)
+            self._advance(state, hour, hour, float(aqi))
+            expected = hour + timedelta(hours=1)
+        if expected <= last_closed:
+            self._advance(state, expected, last_closed, math.nan)
+        state['last_hour'] = last_closed
+
+    def _advance(self, state, first, last, aqi):
+        """Apply the same AQI to every hour from first to last, in O(1)"""
+        hours = int((last - first).total_seconds() // 3600) + 1
+        for i, rule in enumerate(self.rules):
+            if rule.matches(aqi):
+                before = state['runs'][i]
+                state['runs'][i] += hours
+                if state['firing'][i] is None and state['runs'][i] >= rule.for_hours:
+                    # The run reached for_hours at this hour
+                    fired_at = first + timedelta(hours=rule.for_hours - before - 1)
+                    state['firing'][i] = fired_at
+                    self._emit(rule, state['mac'], 'firing', fired_at, aqi)
+            else:
+                state['runs'][i] = 0
+                if state['firing'][i] is not None:
+                    state['firing'][i] = None
+                    self._emit(rule, state['mac'], 'resolved', first, aqi)
+
+    def _emit(self, rule, mac, status, hour, aqi):
+        event = {
+            'rule': rule.name,
+            'mac': mac,
+            'state': status,
+            'hour': hour.strftime(HOUR_FORMAT),
+            'aqi': None if math.isnan(aqi) else aqi,
+            'description': rule.description
+        }
+        self._recent.append(event)
+        for sink in self.sinks:
+            try:
+                sink.send(event)
+            except Exception as e:
+                logger.warning("Alert sink %s failed: %s", type(sink).__name__, e)
+
+    def status(self):
+        with self._lock:
+            states = list(self._devices.values())
+        active = [
+            {'rule': rule.name, 'mac': state['mac'], 'since': since.strftime(HOUR_FORMAT), 'hours': state['runs'][i]}
+            for state in states
+            for i, (rule, since) in enumerate(zip(self.rules, state['firing']))
+            if since is not None
+        ]
+        return {
+            'rules': [rule.to_dict() for rule in self.rules],
+            'devices': len(states),
+            'active': active,
+            'recent': list(self._recent)
+        }
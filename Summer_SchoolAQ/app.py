@@ -1,109 +1,228 @@
-from flask import Flask, render_template, request, jsonify, send_file
-import requests
+from flask import Flask, Response, g, render_template, request, jsonify, send_file, stream_with_context
+from werkzeug.http import dump_options_header
 import pandas as pd
 import json
-from datetime import datetime, timedelta
-import io
+import asyncio
+import functools
+import hashlib
+import itertools
+import logging
+from datetime import datetime, timedelta, timezone
 import os
+import time
+import unicodedata
 from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from upstream import UpstreamClient
+from async_upstream import AsyncUpstreamClient, AsyncSingleFlight, EventLoopThread
+from geocache import GeocodeCache
+from cache import SingleFlight, TTLCache
+from devices import DeviceRegistry
+from timeseries import HourlyStore, floor_hour
+from scheduler import IngestionScheduler
+from live import LiveFeed, sse_events
+from fleet import FleetSnapshot
+from alerts import AlertEngine, LogSink, WebhookSink, load_rules
+from export_cache import ExportCache, artifact_key, iter_gunzip
+from observability import (
+    REGISTRY, CONVERSION_SECONDS, EXPORT_CACHE_LOOKUPS, RESPONSE_ROWS, REQUESTS_IN_FLIGHT, REQUEST_SECONDS,
+    configure_logging, server_timing_header, start_timing, stop_timing, timed
+)
+from records import (
+    hourly_frame, empty_hourly_frame, frame_to_records, iter_csv, iter_zip,
+    EXPORT_FORMATS, parse_export_format, frame_to_bytes, preview_payload, records_frame,
+    rollup_frame, empty_rollup_frame, ROLLUP_COLUMNS, ROLLUP_PERIODS
+)
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
 # Configuration
-API_BASE_URL = "http://airview.cs.upt.ro"
+API_BASE_URL = os.environ.get('AIRVIEW_API_URL', "http://airview.cs.upt.ro")
+GEOCODE_API_URL = os.environ.get('GEOCODE_API_URL', "https://api.bigdatacloud.net/data/reverse-geocode-client")
+
+# Upstream HTTP pool (one per worker process)
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 2))
+HTTP_BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', 0.5))
+
+# UPSTREAM_MODE=async runs upstream I/O on one asyncio loop per process (needs httpx)
+UPSTREAM_MODE = os.environ.get('UPSTREAM_MODE', 'sync')
+ASYNC_POOL_SIZE = int(os.environ.get('ASYNC_POOL_SIZE', 100))
+UPSTREAM_HOST_LIMIT = int(os.environ.get('UPSTREAM_HOST_LIMIT', 50))
+# How long upstream work done by asgi.py for a request spares its Flask handler from repeating it
+PREFETCH_TTL = int(os.environ.get('PREFETCH_TTL', 30))
+
+# Saved devices; the old JSON file is imported into the registry on first start
+DEVICES_DB = os.environ.get('DEVICES_DB', 'devices.sqlite3')
+LEGACY_DEVICES_FILE = os.environ.get('LEGACY_DEVICES_FILE', 'saved_devices.json')
+
+# Device probes (/api/devices/test*): how long a result is reused, how many run at once
+PROBE_CACHE_TTL = int(os.environ.get('PROBE_CACHE_TTL', 300))
+PROBE_WORKERS = int(os.environ.get('PROBE_WORKERS', 32))
+MAX_PROBE_BATCH = int(os.environ.get('MAX_PROBE_BATCH', 1000))
+
+# Reverse-geocode cache (memory LRU in front of a SQLite file)
+GEOCODE_CACHE_DB = os.environ.get('GEOCODE_CACHE_DB', 'geocode_cache.sqlite3')
+GEOCODE_CACHE_TTL = int(os.environ.get('GEOCODE_CACHE_TTL', 30 * 86400))
+GEOCODE_NEGATIVE_TTL = int(os.environ.get('GEOCODE_NEGATIVE_TTL', 600))
+
+# Per-device context (latest reading, coordinates, location) shared by all data paths
+DEVICE_CONTEXT_TTL = int(os.environ.get('DEVICE_CONTEXT_TTL', 60))
+UPSTREAM_WORKERS = int(os.environ.get('UPSTREAM_WORKERS', 8))
+
+# Browser/proxy lifetime of responses whose hours are all closed and final
+CLOSED_RANGE_MAX_AGE = int(os.environ.get('CLOSED_RANGE_MAX_AGE', 86400))
+
+# Records per /preview_data page unless the client asks for another limit
+PREVIEW_PAGE_SIZE = int(os.environ.get('PREVIEW_PAGE_SIZE', 200))
+
+# Devices fetched concurrently by the bulk export endpoint
+BULK_EXPORT_WORKERS = int(os.environ.get('BULK_EXPORT_WORKERS', 8))
+
+# Local hourly AQI history; the 24h endpoint only reaches back MAX_UPSTREAM_HOURS
+HISTORY_DB = os.environ.get('HISTORY_DB', 'aqi_history.sqlite3')
+MAX_UPSTREAM_HOURS = int(os.environ.get('MAX_UPSTREAM_HOURS', 168))
+# How long a reading of the still-open hour, or a latest reading, may be reused
+HISTORY_PROVISIONAL_TTL = int(os.environ.get('HISTORY_PROVISIONAL_TTL', 300))
+LATEST_MAX_AGE = int(os.environ.get('LATEST_MAX_AGE', 300))
+
+# Finished /download_data files kept on disk (see export_cache.py); an empty EXPORT_CACHE_DIR turns it off
+EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR', 'export_cache')
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Background ingestion of saved devices (see scheduler.py)
+INGEST_ENABLED = os.environ.get('INGEST_ENABLED', '0') == '1'
+INGEST_INTERVAL = int(os.environ.get('INGEST_INTERVAL', 300))
+INGEST_HOURS = int(os.environ.get('INGEST_HOURS', 72))  # covers the hourly view's 71-hour window
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 4))
+INGEST_LOCK_FILE = os.environ.get('INGEST_LOCK_FILE', 'ingest.lock')
+
+# Alert rules evaluated as the scheduler ingests (see alerts.py); built-in rules if the file is missing
+ALERT_RULES_FILE = os.environ.get('ALERT_RULES_FILE', 'alert_rules.json')
+ALERT_WEBHOOK_URL = os.environ.get('ALERT_WEBHOOK_URL')
+
+# Live readings pushed over Server-Sent Events (/api/live); one poller per watched device
+LIVE_POLL_INTERVAL = int(os.environ.get('LIVE_POLL_INTERVAL', 60))
+LIVE_MAX_DEVICES = int(os.environ.get('LIVE_MAX_DEVICES', 500))
+LIVE_HEARTBEAT = int(os.environ.get('LIVE_HEARTBEAT', 15))
+
+# Fleet snapshot (/api/fleet/snapshot): saved devices fetched concurrently, answered within a budget
+FLEET_WORKERS = int(os.environ.get('FLEET_WORKERS', 32))
+FLEET_BUDGET = float(os.environ.get('FLEET_BUDGET', 2.0))
+FLEET_MAX_BUDGET = float(os.environ.get('FLEET_MAX_BUDGET', 10.0))
+# Readings older than this mark a device stale; slow devices fall back to a stored reading this recent
+FLEET_STALE_AFTER = int(os.environ.get('FLEET_STALE_AFTER', 3600))
+FLEET_FALLBACK_MAX_AGE = int(os.environ.get('FLEET_FALLBACK_MAX_AGE', 86400))
+
+# Logging (LOG_FORMAT=json for one JSON object per line) and per-request Server-Timing headers
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+configure_logging(LOG_LEVEL, LOG_FORMAT)
+
+# Fallback coordinates for Timișoara area if device doesn't provide them
+DEFAULT_COORDINATES = (45.7613, 21.2513)
 
 class AirQualityAPI:
-    def __init__(self, base_url):
+    def __init__(self, base_url, http=None, geocode_url=GEOCODE_API_URL, geocode_cache=None, history=None, devices=None,
+                 exports=None):
         self.base_url = base_url.rstrip('/')
-        self.devices_file = 'saved_devices.json'
+        self.geocode_url = geocode_url
+        self.devices = devices or DeviceRegistry(DEVICES_DB, legacy_file=LEGACY_DEVICES_FILE)
+        self.http = http or UpstreamClient(
+            pool_size=HTTP_POOL_SIZE,
+            connect_timeout=HTTP_CONNECT_TIMEOUT,
+            max_retries=HTTP_MAX_RETRIES,
+            backoff_factor=HTTP_BACKOFF_FACTOR
+        )
+        self.geocode_cache = geocode_cache or GeocodeCache(
+            GEOCODE_CACHE_DB,
+            ttl=GEOCODE_CACHE_TTL,
+            negative_ttl=GEOCODE_NEGATIVE_TTL
+        )
+        self.history = history or HourlyStore(HISTORY_DB, provisional_ttl=HISTORY_PROVISIONAL_TTL)
+        self.exports = exports or (ExportCache(EXPORT_CACHE_DIR, max_bytes=EXPORT_CACHE_MAX_BYTES) if EXPORT_CACHE_DIR else None)
+        self.context_cache = TTLCache(maxsize=4096, ttl=DEVICE_CONTEXT_TTL)
+        self.executor = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS, thread_name_prefix='upstream')
+        # Identical concurrent upstream fetches (same endpoint, device, hours) share one request
+        self.inflight = SingleFlight()
+        self.probe_cache = TTLCache(maxsize=4096, ttl=PROBE_CACHE_TTL)
     
     def get_saved_devices(self):
-        """Get list of saved devices from local file"""
+        """Get list of saved devices"""
         try:
-            if os.path.exists(self.devices_file):
-                with open(self.devices_file, 'r') as f:
-                    return json.load(f)
-            return []
+            return self.devices.all()
         except Exception as e:
-            print(f"Error loading saved devices: {e}")
+            logger.warning("Error loading saved devices: %s", e)
             return []
     
     def save_device(self, mac, name=None):
-        """Save a working device to the local file"""
+        """Save a working device, or update the name and test time of a saved one"""
         try:
-            saved_devices = self.get_saved_devices()
-            
-            # Check if device already exists
-            for device in saved_devices:
-                if device['mac'].lower() == mac.lower():
-                    # Update existing device
-                    device['name'] = name or device.get('name', f"Device {mac}")
-                    device['last_tested'] = datetime.now().isoformat()
-                    break
-            else:
-                # Add new device
-                new_device = {
-                    'mac': mac,
-                    'name': name or f"Device {mac}",
-                    'added_date': datetime.now().isoformat(),
-                    'last_tested': datetime.now().isoformat()
-                }
-                saved_devices.append(new_device)
-            
-            # Save to file
-            with open(self.devices_file, 'w') as f:
-                json.dump(saved_devices, f, indent=2)
-            
+            self.devices.save(mac, name)
             return True
         except Exception as e:
-            print(f"Error saving device: {e}")
+            logger.warning("Error saving device: %s", e)
             return False
     
     def remove_device(self, mac):
         """Remove a device from saved list"""
         try:
-            saved_devices = self.get_saved_devices()
-            original_count = len(saved_devices)
-            
-            saved_devices = [d for d in saved_devices if d['mac'].lower() != mac.lower()]
-            
-            if len(saved_devices) < original_count:
-                with open(self.devices_file, 'w') as f:
-                    json.dump(saved_devices, f, indent=2)
-                return True
-            return False
+            return self.devices.remove(mac)
         except Exception as e:
-            print(f"Error removing device: {e}")
+            logger.warning("Error removing device: %s", e)
             return False
     
     def test_device(self, mac):
         """Test if a device MAC address works"""
         try:
-            url = f"{self.base_url}/api/v1/data-intake/{mac}"
-            response = requests.get(url, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data and isinstance(data, dict):
-                    # Look for air quality data fields
-                    air_quality_fields = [
-                        'mac', 'timestamp', 't', 'pm25', 'pm10', 'co', 'no2', 'iaq'
-                    ]
-                    found_fields = [field for field in air_quality_fields if field in data]
-                    
-                    if len(found_fields) >= 2:
-                        return True, f"Device working - found: {', '.join(found_fields[:3])}"
-                    else:
-                        return False, "Response doesn't contain expected air quality data"
-                else:
-                    return False, "No data available"
-            elif response.status_code == 404:
-                return False, "Device not found"
-            else:
-                return False, f"HTTP {response.status_code}"
+            url = f"{self.base_url}/api/v1/data-intake/{quote(mac)}"
+            response = self.http.get(url, 'data-intake', timeout=10)
+            return self._test_result(response)
         except Exception as e:
             return False, f"Connection error: {str(e)}"
     
+    def probe_device(self, mac, refresh=False):
+        """test_device with recent results reused; returns (works, message, cached)"""
+        key = mac.strip().lower()
+        if not refresh:
+            result = self.probe_cache.get(key)
+            if result is not None:
+                return result + (True,)
+        
+        works, message = self.inflight.do(('probe', key), self.test_device, mac)
+        self._cache_probe(key, works, message)
+        return works, message, False
+    
+    def _cache_probe(self, key, works, message):
+        # Don't pin a failed probe for the full TTL
+        ttl = PROBE_CACHE_TTL if works else min(PROBE_CACHE_TTL, 30)
+        self.probe_cache.set(key, (works, message), ttl=ttl)
+    
+    def _test_result(self, response):
+        """Judge a /data-intake response: (works, message)"""
+        if response.status_code == 200:
+            data = response.json()
+            if data and isinstance(data, dict):
+                # Look for air quality data fields
+                air_quality_fields = [
+                    'mac', 'timestamp', 't', 'pm25', 'pm10', 'co', 'no2', 'iaq'
+                ]
+                found_fields = [field for field in air_quality_fields if field in data]
+                
+                if len(found_fields) >= 2:
+                    return True, f"Device working - found: {', '.join(found_fields[:3])}"
+                else:
+                    return False, "Response doesn't contain expected air quality data"
+            else:
+                return False, "No data available"
+        elif response.status_code == 404:
+            return False, "Device not found"
+        else:
+            return False, f"HTTP {response.status_code}"
+    
     def get_aqi_level(self, aqi_value):
         """Convert AQI numeric value to descriptive level"""
         if aqi_value is None or aqi_value < 0:
@@ -123,317 +242,992 @@ class AirQualityAPI:
     
     def get_location_from_coords(self, lat, lng):
         """Get location name from coordinates using reverse geocoding"""
+        fallback = f"Coordinates: {lat}, {lng}"
+        if not (lat and lng and lat != 0 and lng != 0):
+            return fallback
+
+        found, location = self.geocode_cache.lookup(lat, lng)
+        if found:
+            return location or fallback
+
+        location = self._reverse_geocode(lat, lng)
+        self.geocode_cache.store(lat, lng, location)
+        return location or fallback
+
+    def _geocode_params(self, lat, lng):
+        return {'latitude': lat, 'longitude': lng, 'localityLanguage': 'en'}
+
+    def _reverse_geocode(self, lat, lng):
+        """Look up a location name upstream; returns None on failure"""
+        key = ('reverse-geocode',) + self.geocode_cache.key(lat, lng)
+        return self.inflight.do(key, self._request_location, lat, lng)
+    
+    def _request_location(self, lat, lng):
         try:
-            if lat and lng and lat != 0 and lng != 0:
-                # Try to get location from a free geocoding service
-                url = f"https://api.bigdatacloud.net/data/reverse-geocode-client?latitude={lat}&longitude={lng}&localityLanguage=en"
-                response = requests.get(url, timeout=5)
-                
-                if response.status_code == 200:
-                    location_data = response.json()
-                    
-                    # Build location string from components
-                    location_parts = []
-                    
-                    if 'locality' in location_data and location_data['locality']:
-                        location_parts.append(location_data['locality'])
-                    elif 'city' in location_data and location_data['city']:
-                        location_parts.append(location_data['city'])
-                    
-                    if 'principalSubdivision' in location_data and location_data['principalSubdivision']:
-                        location_parts.append(location_data['principalSubdivision'])
-                    
-                    if 'countryName' in location_data and location_data['countryName']:
-                        location_parts.append(location_data['countryName'])
-                    
-                    if location_parts:
-                        return ', '.join(location_parts)
-                
-            # Fallback to coordinates
-            return f"Coordinates: {lat}, {lng}"
+            # Try to get location from a free geocoding service
+            response = self.http.get(self.geocode_url, 'reverse-geocode', timeout=5, params=self._geocode_params(lat, lng))
+            return self._location_from_response(response)
+        except Exception as e:
+            logger.warning("Error getting location from coords: %s", e)
+            return None
+    
+    def _location_from_response(self, response):
+        """Build a location string from a reverse-geocode response"""
+        if response.status_code == 200:
+            location_data = response.json()
+            
+            # Build location string from components
+            location_parts = []
+            
+            if 'locality' in location_data and location_data['locality']:
+                location_parts.append(location_data['locality'])
+            elif 'city' in location_data and location_data['city']:
+                location_parts.append(location_data['city'])
             
+            if 'principalSubdivision' in location_data and location_data['principalSubdivision']:
+                location_parts.append(location_data['principalSubdivision'])
+            
+            if 'countryName' in location_data and location_data['countryName']:
+                location_parts.append(location_data['countryName'])
+            
+            if location_parts:
+                return ', '.join(location_parts)
+        
+        return None
+    
+    def _latest_url(self, mac):
+        return f"{self.base_url}/api/v1/data-intake/{quote(mac)}"
+    
+    def _fetch_latest(self, mac):
+        """Fetch the raw latest reading for a device; returns None on failure"""
+        return self.inflight.do(('data-intake', mac.lower()), self._request_latest, mac)
+    
+    def _request_latest(self, mac):
+        try:
+            url = self._latest_url(mac)
+            logger.debug("Requesting latest data: %s", url)
+            response = self.http.get(url, 'data-intake', timeout=10)
+            return self._latest_from_response(response)
         except Exception as e:
-            print(f"Error getting location from coords: {e}")
-            return f"Coordinates: {lat}, {lng}"
+            logger.warning("Error fetching device data: %s", e)
+            return None
+    
+    def _latest_from_response(self, response):
+        logger.debug("Latest data response: Status %s", response.status_code)
+        if response.status_code == 200:
+            return response.json()
+        
+        logger.warning("Error response: %s", response.text[:200])
+        return None
+    
+    def get_device_context(self, mac, refresh=False):
+        """Get latest reading, coordinates and location for a device (cached briefly)"""
+        context, latest = self._cached_context(mac, refresh)
+        if context is not None:
+            return context
+        
+        if latest is None:
+            latest = self._fetch_latest(mac)
+            if latest is not None:
+                self._save_latest(mac, latest)
+        
+        lat, lng = self._coordinates_from(latest)
+        return self._cache_context(mac, latest, lat, lng, self.get_location_from_coords(lat, lng))
+    
+    def _cached_context(self, mac, refresh):
+        """(context, None) from memory, (None, latest) from the store, or (None, None)"""
+        if refresh:
+            return None, None
+        
+        context = self.context_cache.get(mac.lower())
+        if context is not None:
+            return context, None
+        
+        # Another worker (or the ingestion scheduler) may have fetched it recently
+        return None, self._load_latest(mac)
+    
+    def _coordinates_from(self, latest):
+        lat, lng = DEFAULT_COORDINATES
+        if isinstance(latest, dict):
+            try:
+                device_lat = latest.get('lat') or latest.get('latitude')
+                device_lng = latest.get('lng') or latest.get('longitude')
+                if device_lat and device_lng:
+                    lat, lng = float(device_lat), float(device_lng)
+            except (TypeError, ValueError) as e:
+                logger.warning("Error getting device coordinates: %s", e)
+        return lat, lng
+    
+    def _cache_context(self, mac, latest, lat, lng, location):
+        context = {
+            'latest': latest,
+            'latitude': lat,
+            'longitude': lng,
+            'location': location
+        }
+        
+        # Don't pin a failed fetch for the full TTL
+        ttl = DEVICE_CONTEXT_TTL if latest is not None else min(DEVICE_CONTEXT_TTL, 10)
+        self.context_cache.set(mac.lower(), context, ttl=ttl)
+        return context
+    
+    def _load_latest(self, mac):
+        try:
+            return self.history.load_latest(mac, LATEST_MAX_AGE)
+        except Exception as e:
+            logger.warning("Error loading stored latest reading: %s", e)
+            return None
+    
+    def _save_latest(self, mac, latest):
+        try:
+            self.history.save_latest(mac, latest)
+        except Exception as e:
+            logger.warning("Error storing latest reading: %s", e)
     
     def get_device_coordinates(self, mac):
         """Get device coordinates from the latest data"""
+        context = self.get_device_context(mac)
+        return context['latitude'], context['longitude']
+    
+    def _series_url(self, mac, hours):
+        return f"{self.base_url}/api/v1/data-intake-24h/{quote(mac)}/{hours}"
+    
+    def _fetch_24h(self, mac, hours):
+        """Fetch the hourly AQI series ending now; returns a list or None"""
+        return self.inflight.do(('data-intake-24h', mac.lower(), hours), self._request_24h, mac, hours)
+    
+    def _request_24h(self, mac, hours):
         try:
-            url = f"{self.base_url}/api/v1/data-intake/{quote(mac)}"
-            response = requests.get(url, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if isinstance(data, dict):
-                    lat = data.get('lat') or data.get('latitude')
-                    lng = data.get('lng') or data.get('longitude') 
-                    
-                    if lat and lng:
-                        return float(lat), float(lng)
-            
-            # Fallback coordinates for Timișoara area if device doesn't provide them
-            return 45.7613, 21.2513
-            
+            url = self._series_url(mac, hours)
+            logger.debug("Trying 24h endpoint: %s", url)
+            response = self.http.get(url, 'data-intake-24h', timeout=30)
+            return self._series_from_response(response)
+        except Exception as e:
+            logger.warning("Exception with 24h endpoint: %s", e)
+            return None
+    
+    def _series_from_response(self, response):
+        logger.debug("24h endpoint response: Status %s", response.status_code)
+        
+        if response.status_code == 200:
+            data = response.json()
+            logger.debug("24h endpoint returned: %s with %s items", type(data), len(data) if isinstance(data, list) else 'N/A')
+            return data if isinstance(data, list) else None
+        elif response.status_code == 400:
+            logger.warning("Bad request (400): %s", response.text[:200])
+        elif response.status_code == 404:
+            logger.warning("24h endpoint not found (404)")
+        else:
+            logger.warning("Error %s: %s", response.status_code, response.text[:100])
+        return None
+    
+    def _store_history(self, mac, data, requested_hour):
+        """Merge a 24h series requested during requested_hour into the local store"""
+        try:
+            return self._merge_history(mac, data, requested_hour)
         except Exception as e:
-            print(f"Error getting device coordinates: {e}")
-            return 45.7613, 21.2513
+            logger.warning("Error storing hourly history: %s", e)
+            return False
+    
+    def _merge_history(self, mac, data, requested_hour):
+        """Merge a 24h series and drop the cached exports built from the hours it rewrote
+
+        The series ends at the hour current when the upstream answered,
+        which is only known to be requested_hour if the clock has not
+        passed an hour boundary since the request. Otherwise every value
+        could be labelled an hour off, so the series is dropped (False).
+        """
+        if floor_hour(datetime.now()) != requested_hour:
+            logger.info("Dropping the 24h series of %s requested during %s: the hour changed in flight", mac, requested_hour)
+            return False
+        self.history.merge(mac, data, requested_hour)
+        if self.exports is not None:
+            self.exports.invalidate(mac, requested_hour - timedelta(hours=len(data) - 1), requested_hour)
+        return True
+    
+    def _fetch_24h_with_context(self, mac, hours, refresh=False):
+        """Fetch the 24h series and the device context concurrently"""
+        context_future = self.executor.submit(self.get_device_context, mac, refresh)
+        data = self._fetch_24h(mac, hours)
+        context = context_future.result()
+        logger.debug("Device location: %s (%s, %s)", context['location'], context['latitude'], context['longitude'])
+        return data, context
+    
+    def _hours_to_fetch(self, mac, start_hour, end_hour, current_hour):
+        """How many trailing hours the 24h endpoint must return to fill the store, or None
+
+        The 24h endpoint always ends at the current hour and only reaches
+        back MAX_UPSTREAM_HOURS, so older gaps stay gaps. current_hour is
+        the hour taken just before the request, which its series ends at.
+        """
+        fetchable_from = max(start_hour, current_hour - timedelta(hours=MAX_UPSTREAM_HOURS - 1))
+        missing_from = self.history.first_missing_hour(mac, fetchable_from, min(end_hour, current_hour))
+        
+        if missing_from is None:
+            logger.debug("Hours %s to %s served from local store", start_hour, end_hour)
+            return None
+        
+        hours_to_fetch = int((current_hour - missing_from).total_seconds() // 3600) + 1
+        logger.debug("Fetching %s hours of data to cover requested range", hours_to_fetch)
+        return hours_to_fetch
+    
+    def _merge_fetched(self, mac, data, requested_hour):
+        if isinstance(data, list) and len(data) > 0:
+            logger.debug("Got %s hourly values", len(data))
+            self._store_history(mac, data, requested_hour)
+        else:
+            logger.debug("No valid data in response")
+    
+    def _ensure_history(self, mac, start_hour, end_hour):
+        """Fetch whatever part of [start_hour, end_hour] the local store lacks; returns the device context"""
+        current_hour = floor_hour(datetime.now())
+        hours_to_fetch = self._hours_to_fetch(mac, start_hour, end_hour, current_hour)
+        if hours_to_fetch is None:
+            return self.get_device_context(mac)
+        
+        data, context = self._fetch_24h_with_context(mac, hours_to_fetch)
+        self._merge_fetched(mac, data, current_hour)
+        return context
+    
+    def refresh_device(self, mac, hours):
+        """Re-fetch a device's latest reading and backfill its last hours; returns (ok, hours fetched)
+
+        Only the hours back to the earliest one the store does not cover are
+        requested, so a device whose window is complete costs just the
+        latest reading.
+        """
+        current_hour = floor_hour(datetime.now())
+        hours_to_fetch = self._hours_to_fetch(mac, current_hour - timedelta(hours=hours - 1), current_hour, current_hour)
+        if hours_to_fetch is None:
+            context = self.get_device_context(mac, refresh=True)
+            return context['latest'] is not None, 0
+        
+        data, context = self._fetch_24h_with_context(mac, hours_to_fetch, refresh=True)
+        if isinstance(data, list) and len(data) > 0:
+            merged = self._merge_history(mac, data, current_hour)
+            return context['latest'] is not None, len(data) if merged else 0
+        return False, 0
+    
+    def hourly_coverage(self, mac, hours_from, hours_to, gaps=False):
+        return self.history.coverage(mac, *self._hourly_window(hours_from, hours_to), gaps=gaps)
+    
+    def date_range_coverage(self, mac, start_date, end_date, gaps=False):
+        window = self._date_range_window(start_date, end_date)
+        return self.history.coverage(mac, window[0], window[1], gaps=gaps)
+    
+    def date_range_fetched(self, mac, start_date, end_date):
+        """Whether the store holds every hour of a date range that the upstream can still serve"""
+        window = self._date_range_window(start_date, end_date)
+        return self._hours_to_fetch(mac, window[0], window[1], floor_hour(datetime.now())) is None
+    
+    def range_version(self, mac, start_hour, end_hour):
+        """Version of the stored data behind a window: {'tag', 'modified', 'max_age', 'window'}
+
+        Whatever the store lacks is fetched first, so the version describes
+        what a response built right after would contain. ``max_age`` is None
+        once every hour of the window is closed and final.
+        """
+        context = self._ensure_history(mac, start_hour, end_hour)
+        rows, provisional, ingested_at = self.history.window_stats(mac, start_hour, end_hour)
+        
+        now = datetime.now()
+        current_hour = floor_hour(now)
+        if end_hour < current_hour and provisional == 0:
+            max_age = None
+        else:
+            # The open hour is re-fetched after HISTORY_PROVISIONAL_TTL and a new one starts on the hour
+            max_age = min(int((current_hour + timedelta(hours=1) - now).total_seconds()) + 1, HISTORY_PROVISIONAL_TTL)
+        
+        return {
+            'tag': [mac.lower(), str(start_hour), str(end_hour), rows, provisional, ingested_at,
+                    context['location'], context['latitude'], context['longitude']],
+            'modified': ingested_at,
+            'max_age': max_age,
+            'window': (start_hour, end_hour)
+        }
+    
+    def hourly_version(self, mac, hours_from, hours_to):
+        return self.range_version(mac, *self._hourly_window(hours_from, hours_to))
+    
+    def date_range_version(self, mac, start_date, end_date):
+        window = self._date_range_window(start_date, end_date)
+        return self.range_version(mac, window[0], window[1])
+    
+    def latest_version(self, mac):
+        context = self.get_device_context(mac)
+        return {'tag': json.dumps(context, sort_keys=True, default=str), 'modified': None, 'max_age': DEVICE_CONTEXT_TTL}
+    
+    def _hourly_window(self, hours_from, hours_to):
+        """(window start, current hour) covering the hourly view"""
+        # Get enough hours to ensure we have data for the requested time range
+        hours_needed = max(48, hours_to - hours_from + 48)  # Get enough data with buffer
+        current_hour = floor_hour(datetime.now())
+        return current_hour - timedelta(hours=hours_needed - 1), current_hour
+    
+    def _hourly_result(self, mac, context, window, hours_from, hours_to):
+        window_start, current_hour = window
+        hours, values = self.history.read_range(mac, window_start, current_hour)
+        df = hourly_frame(
+            mac, hours, values, context, current_hour,
+            measurement_type='hourly_aqi',
+            data_source='24h_endpoint_real',
+            note_prefix='Real hourly AQI reading',
+            hour_from=hours_from,
+            hour_to=hours_to
+        )
+        
+        if len(df):
+            logger.debug("Processed %s valid readings for hours %s-%s", len(df), hours_from, hours_to)
+        else:
+            logger.debug("No valid readings found for hours %s-%s since %s", hours_from, hours_to, window_start)
+        return df
+    
+    def get_hourly_frame(self, mac, hours_from, hours_to):
+        """Get hourly readings of the last days, restricted to hours of the day, as columns"""
+        logger.debug("Requesting hourly data for MAC %s from hour %s to %s", mac, hours_from, hours_to)
+        
+        try:
+            window = self._hourly_window(hours_from, hours_to)
+            with timed('fetch'):
+                context = self._ensure_history(mac, *window)
+            with timed('build'):
+                return self._hourly_result(mac, context, window, hours_from, hours_to)
+        except Exception as e:
+            logger.warning("Error getting hourly data: %s", e)
+            return empty_hourly_frame()
     
     def get_hourly_data(self, mac, hours_from, hours_to):
         """Get hourly data using the 24h endpoint with proper data processing"""
-        print(f"Requesting hourly data for MAC {mac} from hour {hours_from} to {hours_to}")
+        return frame_to_records(self.get_hourly_frame(mac, hours_from, hours_to))
+    
+    def _date_range_window(self, start_date, end_date):
+        """(range start, range end capped at the current hour, current hour)"""
+        start_dt = datetime.strptime(start_date, '%Y-%m-%d')
+        end_dt = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(hours=23)
+        current_hour = floor_hour(datetime.now())
+        return start_dt, min(end_dt, current_hour), current_hour
+    
+    def _date_range_result(self, mac, context, window, start_date, end_date, start_hour, end_hour):
+        start_dt, range_end, current_hour = window
+        hours, values = self.history.read_range(mac, start_dt, range_end)
+        df = hourly_frame(
+            mac, hours, values, context, current_hour,
+            measurement_type='historical_aqi',
+            data_source='24h_endpoint_historical',
+            note_prefix='Historical AQI reading',
+            hour_from=start_hour,
+            hour_to=end_hour
+        )
         
-        # Get device coordinates first
-        lat, lng = self.get_device_coordinates(mac)
-        location = self.get_location_from_coords(lat, lng)
-        print(f"Device location: {location} ({lat}, {lng})")
+        if len(df):
+            logger.debug("✅ Found %s real historical readings for date range %s to %s", len(df), start_date, end_date)
+        else:
+            logger.debug("No data found in the specified date range %s to %s", start_date, end_date)
+        return df
+    
+    def get_date_range_frame(self, mac, start_date, end_date, start_hour=0, end_hour=23):
+        """Get readings for a date range as columns, from the local store where it covers it"""
+        logger.debug("Requesting date range data from %s to %s, hours %s-%s", start_date, end_date, start_hour, end_hour)
         
         try:
-            # Get enough hours to ensure we have data for the requested time range
-            hours_needed = max(48, hours_to - hours_from + 48)  # Get enough data with buffer
-            
-            # Use the 24h endpoint that actually works
-            url = f"{self.base_url}/api/v1/data-intake-24h/{quote(mac)}/{hours_needed}"
-            print(f"Trying 24h endpoint: {url}")
-            
-            response = requests.get(url, timeout=30)
-            print(f"24h endpoint response: Status {response.status_code}")
-            
-            if response.status_code == 200:
-                try:
-                    data = response.json()
-                    print(f"24h endpoint returned: {type(data)} with {len(data) if isinstance(data, list) else 'N/A'} items")
-                    
-                    if isinstance(data, list) and len(data) > 0:
-                        print(f"✅ SUCCESS! Found {len(data)} hourly values")
-                        
-                        # Count valid readings for debugging
-                        valid_readings = [x for x in data if x != -1]
-                        print(f"Valid readings: {len(valid_readings)} out of {len(data)}")
-                        
-                        # Process the hourly data array
-                        enhanced_data = []
-                        now = datetime.now()
-                        
-                        for i, aqi_value in enumerate(data):
-                            if aqi_value != -1:  # Only include valid readings
-                                # Calculate the timestamp (going backwards from now)
-                                hours_ago = len(data) - 1 - i
-                                timestamp = now - timedelta(hours=hours_ago)
-                                hour = timestamp.hour
-                                
-                                # Check if this hour is in our requested range
-                                if hours_from <= hour <= hours_to:
-                                    reading = {
-                                        'mac': mac,
-                                        'timestamp': timestamp.isoformat() + 'Z',
-                                        'date': timestamp.strftime('%Y-%m-%d'),
-                                        'time': timestamp.strftime('%H:%M:%S'),
-                                        'hour': hour,
-                                        'day_of_week': timestamp.strftime('%A'),
-                                        'aqi': aqi_value,
-                                        'calculatedAqi': aqi_value,
-                                        'aqi_level': self.get_aqi_level(aqi_value),
-                                        'measurement_type': 'hourly_aqi',
-                                        'data_source': '24h_endpoint_real',
-                                        'location': location,
-                                        'latitude': lat,
-                                        'longitude': lng,
-                                        'hours_ago': hours_ago,
-                                        'real_timestamp': True,
-                                        'note': f'Real hourly AQI reading from {timestamp.strftime("%Y-%m-%d %H:00")}'
-                                    }
-                                    enhanced_data.append(reading)
-                        
-                        if enhanced_data:
-                            # Sort by timestamp (oldest first)
-                            enhanced_data.sort(key=lambda x: x['timestamp'])
-                            print(f"Processed {len(enhanced_data)} valid readings for hours {hours_from}-{hours_to}")
-                            return enhanced_data
-                        else:
-                            print(f"No valid readings found for hours {hours_from}-{hours_to} in the last {hours_needed} hours")
-                            return []
-                            
-                except Exception as json_error:
-                    print(f"Error parsing 24h response: {json_error}")
-                    return []
-                    
-            elif response.status_code == 400:
-                print(f"Bad request (400): {response.text[:200]}")
-                return []
-            elif response.status_code == 404:
-                print("24h endpoint not found (404)")
-                return []
-            else:
-                print(f"Error {response.status_code}: {response.text[:100]}")
-                return []
-                
+            window = self._date_range_window(start_date, end_date)
+            with timed('fetch'):
+                context = self._ensure_history(mac, window[0], window[1])
+            with timed('build'):
+                return self._date_range_result(mac, context, window, start_date, end_date, start_hour, end_hour)
         except Exception as e:
-            print(f"Exception with 24h endpoint: {e}")
-            return []
+            logger.warning("Error getting date range data: %s", e)
+            return empty_hourly_frame()
     
     def get_date_range_data(self, mac, start_date, end_date, start_hour=0, end_hour=23):
         """Get data for specific date range using available endpoints"""
-        print(f"Requesting date range data from {start_date} to {end_date}, hours {start_hour}-{end_hour}")
-        
-        # Get device coordinates first
-        lat, lng = self.get_device_coordinates(mac)
-        location = self.get_location_from_coords(lat, lng)
-        print(f"Device location: {location} ({lat}, {lng})")
+        return frame_to_records(self.get_date_range_frame(mac, start_date, end_date, start_hour, end_hour))
+    
+    def get_rollup_frame(self, mac, start_date, end_date, period='day', start_hour=0, end_hour=23):
+        """Daily or weekly AQI statistics for a date range, one row per period"""
+        logger.debug("Requesting %s rollups from %s to %s, hours %s-%s", period, start_date, end_date, start_hour, end_hour)
         
         try:
-            # Calculate how many hours we need to go back to cover the date range
-            start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-            end_dt = datetime.strptime(end_date, '%Y-%m-%d')
-            now = datetime.now()
-            
-            # Calculate hours from now to the start of our date range
-            time_diff = now - start_dt
-            hours_to_fetch = int(time_diff.total_seconds() / 3600) + 48  # Add buffer
+            window = self._date_range_window(start_date, end_date)
+            with timed('fetch'):
+                context = self._ensure_history(mac, window[0], window[1])
+            with timed('build'):
+                return self._rollup_result(mac, context, window, period, start_hour, end_hour)
+        except Exception as e:
+            logger.warning("Error getting rollups: %s", e)
+            return empty_rollup_frame()
+    
+    def _rollup_result(self, mac, context, window, period, start_hour, end_hour):
+        start_dt, range_end, current_hour = window
+        if period == 'day' and (start_hour, end_hour) == (0, 23):
+            return self._daily_rollups(mac, context['location'], start_dt, range_end, current_hour)
+        
+        # Weekly percentiles can't be combined from daily ones, so these come from the hours
+        hours, values = self.history.read_range(mac, start_dt, range_end)
+        return rollup_frame(
+            mac, hours, values, start_dt, range_end, period,
+            location=context['location'], hour_from=start_hour, hour_to=end_hour
+        )
+    
+    def _daily_rollups(self, mac, location, start_dt, range_end, current_hour):
+        """Daily rollups, reusing the stored ones and storing those of closed days"""
+        if start_dt > range_end:
+            return empty_rollup_frame()
+        
+        days = [d.isoformat() for d in pd.date_range(start_dt.date(), range_end.date()).date]
+        stored = self.history.load_rollups(mac, days[0], days[-1])
+        missing = [day for day in days if day not in stored]
+        
+        frames = []
+        if missing:
+            first = datetime.strptime(missing[0], '%Y-%m-%d')
+            last = min(datetime.strptime(missing[-1], '%Y-%m-%d') + timedelta(hours=23), range_end)
+            read_at = time.time()
+            hours, values = self.history.read_range(mac, first, last)
+            computed = rollup_frame(mac, hours, values, first, last, 'day', location=location)
+            computed = computed[computed['period_start'].isin(missing)]
             
-            # Cap at reasonable limit
-            hours_to_fetch = min(hours_to_fetch, 168)  # Max 7 days
+            # Only closed days without provisional hours are final enough to keep
+            open_days = self.history.provisional_days(mac, first, last) | {current_hour.strftime('%Y-%m-%d')}
+            closed = computed[~computed['period_start'].isin(open_days)]
+            self.history.save_rollups(mac, {
+                row.pop('period_start'): row
+                for row in closed.drop(columns=['mac', 'period', 'location']).to_dict(orient='records')
+            }, read_at)
+            logger.debug("Computed %s daily rollups, stored %s", len(computed), len(closed))
+            frames.append(computed)
+        
+        if stored:
+            reused = pd.DataFrame([dict(stats, period_start=day) for day, stats in stored.items()])
+            reused['mac'], reused['period'], reused['location'] = mac, 'day', location
+            frames.append(reused[ROLLUP_COLUMNS])
+        return pd.concat(frames, ignore_index=True).sort_values('period_start', ignore_index=True)
+    
+    def get_device_data(self, mac, refresh=False):
+        """Get latest data for a specific device"""
+        try:
+            with timed('fetch'):
+                context = self.get_device_context(mac, refresh)
+            return self._latest_records(context)
+        except Exception as e:
+            logger.warning("Error fetching device data: %s", e)
+            return []
+    
+    def peek_device_data(self, mac):
+        """Latest data for a device if its context is cached, else None; never fetches"""
+        context = self.context_cache.get(mac.lower())
+        return self._latest_records(context) if context is not None else None
+    
+    def _latest_records(self, context):
+        """Latest reading from a device context, enhanced with location and AQI level"""
+        latest = context['latest']
+        logger.debug("Latest data received: %s", type(latest))
+        
+        if isinstance(latest, dict):
+            # Copy so the cached reading isn't modified
+            data = dict(latest)
             
-            print(f"Fetching {hours_to_fetch} hours of data to cover date range")
+            # Enhance the data
+            data['location'] = context['location']
+            data['latitude'] = context['latitude']
+            data['longitude'] = context['longitude']
+            data['data_source'] = 'latest_reading'
             
-            # Use the 24h endpoint to get historical data
-            url = f"{self.base_url}/api/v1/data-intake-24h/{quote(mac)}/{hours_to_fetch}"
-            print(f"Trying 24h endpoint for date range: {url}")
+            # Add current date/time info if timestamp is missing
+            if 'timestamp' not in data or not data['timestamp']:
+                current_time = datetime.now()
+                data['timestamp'] = current_time.isoformat() + 'Z'
+                data['date'] = current_time.strftime('%Y-%m-%d')
+                data['time'] = current_time.strftime('%H:%M:%S')
             
-            response = requests.get(url, timeout=30)
-            print(f"24h endpoint response: Status {response.status_code}")
+            # Add AQI level
+            if 'calculatedAqi' in data and data['calculatedAqi'] and data['calculatedAqi'] > 0:
+                data['aqi_level'] = self.get_aqi_level(data['calculatedAqi'])
+            elif 'dustAqi' in data and data['dustAqi'] and data['dustAqi'] > 0:
+                data['aqi_level'] = self.get_aqi_level(data['dustAqi'])
+            elif 'iaq' in data and data['iaq'] and data['iaq'] > 0:
+                data['aqi_level'] = self.get_aqi_level(data['iaq'])
             
-            if response.status_code == 200:
-                data = response.json()
-                print(f"Got {len(data)} hourly values")
-                
-                if isinstance(data, list) and len(data) > 0:
-                    enhanced_data = []
-                    
-                    for i, aqi_value in enumerate(data):
-                        if aqi_value != -1:  # Only process valid readings
-                            # Calculate the timestamp (going backwards from now)
-                            hours_ago = len(data) - 1 - i
-                            timestamp = now - timedelta(hours=hours_ago)
-                            
-                            # Check if this timestamp falls within our date range and hour range
-                            record_date = timestamp.strftime('%Y-%m-%d')
-                            record_hour = timestamp.hour
-                            
-                            if (start_date <= record_date <= end_date and 
-                                start_hour <= record_hour <= end_hour):
-                                
-                                reading = {
-                                    'mac': mac,
-                                    'timestamp': timestamp.isoformat() + 'Z',
-                                    'date': record_date,
-                                    'time': timestamp.strftime('%H:%M:%S'),
-                                    'hour': record_hour,
-                                    'day_of_week': timestamp.strftime('%A'),
-                                    'aqi': aqi_value,
-                                    'calculatedAqi': aqi_value,
-                                    'aqi_level': self.get_aqi_level(aqi_value),
-                                    'measurement_type': 'historical_aqi',
-                                    'data_source': '24h_endpoint_historical',
-                                    'location': location,
-                                    'latitude': lat,
-                                    'longitude': lng,
-                                    'hours_ago': hours_ago,
-                                    'real_timestamp': True,
-                                    'note': f'Historical AQI reading from {timestamp.strftime("%Y-%m-%d %H:00")}'
-                                }
-                                enhanced_data.append(reading)
-                    
-                    if enhanced_data:
-                        # Sort by timestamp (oldest first)
-                        enhanced_data.sort(key=lambda x: x['timestamp'])
-                        print(f"✅ Found {len(enhanced_data)} real historical readings for date range {start_date} to {end_date}")
-                        return enhanced_data
-                    else:
-                        print(f"No data found in the specified date range {start_date} to {end_date}")
-                        return []
-                else:
-                    print("No valid data in response")
-                    return []
-            else:
-                print(f"Error {response.status_code}: {response.text[:100]}")
-                return []
-                
-        except Exception as e:
-            print(f"Error getting date range data: {e}")
+            return [data]
+        elif isinstance(latest, list):
+            return latest
+        else:
             return []
+
+class AsyncAirQualityAPI(AirQualityAPI):
+    """AirQualityAPI whose upstream I/O runs on one shared asyncio loop
+
+    The ``a*`` coroutines can be awaited directly by async callers; the
+    inherited synchronous methods used by the Flask routes hand their
+    network waits to the loop, so a slow sensor costs a pending future
+    rather than a connection per thread, and each upstream host is capped
+    at UPSTREAM_HOST_LIMIT concurrent requests.
+
+    Served through asgi.py, the ``aprefetch_*`` coroutines do a request's
+    upstream part before Flask runs it, so the synchronous methods find
+    everything locally and the request thread never waits on the upstream.
+    """
     
-    def get_device_data(self, mac):
-        """Get latest data for a specific device"""
+    def __init__(self, base_url, aio=None, loop=None, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.aio = aio or AsyncUpstreamClient(
+            pool_size=ASYNC_POOL_SIZE,
+            per_host_limit=UPSTREAM_HOST_LIMIT,
+            connect_timeout=HTTP_CONNECT_TIMEOUT,
+            max_retries=HTTP_MAX_RETRIES,
+            backoff_factor=HTTP_BACKOFF_FACTOR
+        )
+        self.loop = loop or EventLoopThread()
+        self.ainflight = AsyncSingleFlight()
+        # SQLite stores can wait seconds on a lock; those calls must not hold up the loop
+        self.store_executor = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS, thread_name_prefix='store')
+        # Upstream work already done for requests that Flask is about to serve
+        self.prefetched = TTLCache(maxsize=4096, ttl=PREFETCH_TTL)
+    
+    async def _off_loop(self, fn, *args):
+        """Run a blocking store or cache call in the store pool and await its result"""
+        return await asyncio.get_running_loop().run_in_executor(self.store_executor, functools.partial(fn, *args))
+    
+    async def atest_device(self, mac):
         try:
-            url = f"{self.base_url}/api/v1/data-intake/{quote(mac)}"
-            print(f"Requesting latest data: {url}")
-            response = requests.get(url, timeout=10)
-            print(f"Latest data response: Status {response.status_code}")
-            
-            if response.status_code == 200:
-                data = response.json()
-                print(f"Latest data received: {type(data)}")
-                
-                if isinstance(data, dict):
-                    # Get coordinates from the data
-                    lat = data.get('lat') or data.get('latitude') or 45.7613
-                    lng = data.get('lng') or data.get('longitude') or 21.2513
-                    
-                    # Get location from coordinates
-                    location = self.get_location_from_coords(lat, lng)
-                    
-                    # Enhance the data
-                    data['location'] = location
-                    data['latitude'] = lat
-                    data['longitude'] = lng
-                    data['data_source'] = 'latest_reading'
-                    
-                    # Add current date/time info if timestamp is missing
-                    if 'timestamp' not in data or not data['timestamp']:
-                        current_time = datetime.now()
-                        data['timestamp'] = current_time.isoformat() + 'Z'
-                        data['date'] = current_time.strftime('%Y-%m-%d')
-                        data['time'] = current_time.strftime('%H:%M:%S')
-                    
-                    # Add AQI level
-                    if 'calculatedAqi' in data and data['calculatedAqi'] and data['calculatedAqi'] > 0:
-                        data['aqi_level'] = self.get_aqi_level(data['calculatedAqi'])
-                    elif 'dustAqi' in data and data['dustAqi'] and data['dustAqi'] > 0:
-                        data['aqi_level'] = self.get_aqi_level(data['dustAqi'])
-                    elif 'iaq' in data and data['iaq'] and data['iaq'] > 0:
-                        data['aqi_level'] = self.get_aqi_level(data['iaq'])
-                    
-                    return [data]
-                elif isinstance(data, list):
-                    return data
-                else:
-                    return []
-            else:
-                print(f"Error response: {response.text}")
-                return []
+            response = await self.aio.get(self._latest_url(mac), 'data-intake', timeout=10)
+            return self._test_result(response)
         except Exception as e:
-            print(f"Error fetching device data: {e}")
+            return False, f"Connection error: {str(e)}"
+    
+    async def aget_location_from_coords(self, lat, lng):
+        fallback = f"Coordinates: {lat}, {lng}"
+        if not (lat and lng and lat != 0 and lng != 0):
+            return fallback
+        
+        found, location = await self._off_loop(self.geocode_cache.lookup, lat, lng)
+        if found:
+            return location or fallback
+        
+        key = ('reverse-geocode',) + self.geocode_cache.key(lat, lng)
+        location = await self.ainflight.do(key, lambda: self._arequest_location(lat, lng))
+        await self._off_loop(self.geocode_cache.store, lat, lng, location)
+        return location or fallback
+    
+    async def _arequest_location(self, lat, lng):
+        try:
+            response = await self.aio.get(self.geocode_url, 'reverse-geocode', timeout=5, params=self._geocode_params(lat, lng))
+            return self._location_from_response(response)
+        except Exception as e:
+            logger.warning("Error getting location from coords: %s", e)
+            return None
+    
+    async def afetch_latest(self, mac):
+        return await self.ainflight.do(('data-intake', mac.lower()), lambda: self._arequest_latest(mac))
+    
+    async def _arequest_latest(self, mac):
+        try:
+            url = self._latest_url(mac)
+            logger.debug("Requesting latest data: %s", url)
+            return self._latest_from_response(await self.aio.get(url, 'data-intake', timeout=10))
+        except Exception as e:
+            logger.warning("Error fetching device data: %s", e)
+            return None
+    
+    async def afetch_24h(self, mac, hours):
+        key = ('data-intake-24h', mac.lower(), hours)
+        return await self.ainflight.do(key, lambda: self._arequest_24h(mac, hours))
+    
+    async def _arequest_24h(self, mac, hours):
+        try:
+            url = self._series_url(mac, hours)
+            logger.debug("Trying 24h endpoint: %s", url)
+            return self._series_from_response(await self.aio.get(url, 'data-intake-24h', timeout=30))
+        except Exception as e:
+            logger.warning("Exception with 24h endpoint: %s", e)
+            return None
+    
+    async def aget_device_context(self, mac, refresh=False):
+        context, latest = await self._off_loop(self._cached_context, mac, refresh)
+        if context is not None:
+            return context
+        
+        if latest is None:
+            latest = await self.afetch_latest(mac)
+            if latest is not None:
+                await self._off_loop(self._save_latest, mac, latest)
+        
+        lat, lng = self._coordinates_from(latest)
+        location = await self.aget_location_from_coords(lat, lng)
+        return self._cache_context(mac, latest, lat, lng, location)
+    
+    async def afetch_24h_with_context(self, mac, hours, refresh=False):
+        data, context = await asyncio.gather(
+            self.afetch_24h(mac, hours),
+            self.aget_device_context(mac, refresh)
+        )
+        logger.debug("Device location: %s (%s, %s)", context['location'], context['latitude'], context['longitude'])
+        return data, context
+    
+    async def _aensure_history(self, mac, start_hour, end_hour):
+        current_hour = floor_hour(datetime.now())
+        hours_to_fetch = await self._off_loop(self._hours_to_fetch, mac, start_hour, end_hour, current_hour)
+        if hours_to_fetch is None:
+            return await self.aget_device_context(mac)
+        
+        data, context = await self.afetch_24h_with_context(mac, hours_to_fetch)
+        await self._off_loop(self._merge_fetched, mac, data, current_hour)
+        return context
+    
+    async def aget_hourly_frame(self, mac, hours_from, hours_to):
+        logger.debug("Requesting hourly data for MAC %s from hour %s to %s", mac, hours_from, hours_to)
+        try:
+            window = self._hourly_window(hours_from, hours_to)
+            context = await self._aensure_history(mac, *window)
+            return await self._off_loop(self._hourly_result, mac, context, window, hours_from, hours_to)
+        except Exception as e:
+            logger.warning("Error getting hourly data: %s", e)
+            return empty_hourly_frame()
+    
+    async def aget_date_range_frame(self, mac, start_date, end_date, start_hour=0, end_hour=23):
+        logger.debug("Requesting date range data from %s to %s, hours %s-%s", start_date, end_date, start_hour, end_hour)
+        try:
+            window = self._date_range_window(start_date, end_date)
+            context = await self._aensure_history(mac, window[0], window[1])
+            return await self._off_loop(
+                self._date_range_result, mac, context, window, start_date, end_date, start_hour, end_hour
+            )
+        except Exception as e:
+            logger.warning("Error getting date range data: %s", e)
+            return empty_hourly_frame()
+    
+    async def aget_rollup_frame(self, mac, start_date, end_date, period='day', start_hour=0, end_hour=23):
+        logger.debug("Requesting %s rollups from %s to %s, hours %s-%s", period, start_date, end_date, start_hour, end_hour)
+        try:
+            window = self._date_range_window(start_date, end_date)
+            context = await self._aensure_history(mac, window[0], window[1])
+            return await self._off_loop(self._rollup_result, mac, context, window, period, start_hour, end_hour)
+        except Exception as e:
+            logger.warning("Error getting rollups: %s", e)
+            return empty_rollup_frame()
+    
+    async def aget_device_data(self, mac, refresh=False):
+        try:
+            return self._latest_records(await self.aget_device_context(mac, refresh))
+        except Exception as e:
+            logger.warning("Error fetching device data: %s", e)
             return []
+    
+    # Upstream parts of requests, awaited by asgi.py before Flask serves them
+    
+    async def aprefetch_probe(self, mac):
+        """Probe a device afresh for a /api/devices/test request"""
+        key = mac.strip().lower()
+        works, message = await self.ainflight.do(('probe', key), lambda: self.atest_device(mac))
+        self._cache_probe(key, works, message)
+        self.prefetched.set(('probe', key), True)
+    
+    async def aprefetch_data(self, mac, data_type, params):
+        """Fill the store and device context for a data request; params as parse_data_form returns them"""
+        if data_type == 'latest':
+            await self.aget_device_context(mac)
+            return
+        
+        if data_type == 'hourly':
+            window = self._hourly_window(params['hours_from'], params['hours_to'])
+        else:
+            window = self._date_range_window(params['start_date'], params['end_date'])
+        current_hour = floor_hour(datetime.now())
+        await self._aensure_history(mac, window[0], window[1])
+        # Marked even if the fetch failed: the handler must not wait on a second try
+        self.prefetched.set(('24h', mac.lower(), current_hour), True)
+    
+    # Synchronous entry points used by the Flask routes and the scheduler
+    
+    def test_device(self, mac):
+        return self.loop.run(self.atest_device(mac))
+    
+    def probe_device(self, mac, refresh=False):
+        # A fresh probe for this very request was just cached
+        if refresh and self.prefetched.get(('probe', mac.strip().lower())):
+            refresh = False
+        return super().probe_device(mac, refresh)
+    
+    def get_device_context(self, mac, refresh=False):
+        return self.loop.run(self.aget_device_context(mac, refresh))
+    
+    def _fetch_24h_with_context(self, mac, hours, refresh=False):
+        if not refresh and self.prefetched.get(('24h', mac.lower(), floor_hour(datetime.now()))):
+            # Fetched moments ago for this request; what the store still lacks, the upstream does too
+            return None, self.get_device_context(mac)
+        return self.loop.run(self.afetch_24h_with_context(mac, hours, refresh))
 
 # Initialize API client
-api_client = AirQualityAPI(API_BASE_URL)
-
-def flatten_nested_dict(d, parent_key='', sep='_'):
-    """Recursively flatten nested dictionaries"""
-    items = []
-    for k, v in d.items():
-        new_key = f"{parent_key}{sep}{k}" if parent_key else k
-        if isinstance(v, dict):
-            items.extend(flatten_nested_dict(v, new_key, sep=sep).items())
-        elif isinstance(v, list):
-            # Convert list to string representation
-            items.append((new_key, str(v)))
+if UPSTREAM_MODE == 'async':
+    api_client = AsyncAirQualityAPI(API_BASE_URL)
+else:
+    api_client = AirQualityAPI(API_BASE_URL)
+
+# Separate pool: bulk fetches wait on api_client.executor and must not starve it
+bulk_executor = ThreadPoolExecutor(max_workers=BULK_EXPORT_WORKERS, thread_name_prefix='bulk')
+probe_executor = ThreadPoolExecutor(max_workers=PROBE_WORKERS, thread_name_prefix='probe')
+
+alert_sinks = [LogSink()]
+if ALERT_WEBHOOK_URL:
+    alert_sinks.append(WebhookSink(ALERT_WEBHOOK_URL))
+alert_engine = AlertEngine(load_rules(ALERT_RULES_FILE), alert_sinks)
+
+# Keep saved devices warm in the background; only one process wins the lock
+scheduler = IngestionScheduler(
+    api_client,
+    interval=INGEST_INTERVAL,
+    hours=INGEST_HOURS,
+    max_workers=INGEST_WORKERS,
+    lock_file=INGEST_LOCK_FILE,
+    alerts=alert_engine
+)
+if INGEST_ENABLED:
+    scheduler.start()
+
+live_feed = LiveFeed(api_client, interval=LIVE_POLL_INTERVAL, max_devices=LIVE_MAX_DEVICES)
+
+fleet = FleetSnapshot(
+    api_client,
+    max_workers=FLEET_WORKERS,
+    stale_after=FLEET_STALE_AFTER,
+    fallback_max_age=FLEET_FALLBACK_MAX_AGE
+)
+
+def parse_mac_list(values):
+    """MACs from form values separated by commas, whitespace or newlines, duplicates dropped"""
+    macs = []
+    for value in values:
+        macs.extend(m for m in value.replace(',', ' ').split() if m)
+    # Drop duplicates, keep order
+    return list({mac.lower(): mac for mac in macs}.values())
+
+def parse_rollup_form(form):
+    """(start_date, end_date, start_hour, end_hour, period) from a form; ValueError says what is wrong"""
+    start_date = form.get('start_date')
+    end_date = form.get('end_date')
+    period = form.get('period', 'day')
+    
+    if not start_date or not end_date:
+        raise ValueError('Start date and end date are required')
+    if period not in ROLLUP_PERIODS:
+        raise ValueError('Period must be "day" or "week"')
+    
+    try:
+        datetime.strptime(start_date, '%Y-%m-%d')
+        datetime.strptime(end_date, '%Y-%m-%d')
+        start_hour = int(form.get('start_hour', '0'))
+        end_hour = int(form.get('end_hour', '23'))
+    except ValueError:
+        raise ValueError('Invalid date format. Use YYYY-MM-DD')
+    
+    if start_hour < 0 or start_hour > 23 or end_hour < 0 or end_hour > 23:
+        raise ValueError('Hours must be between 0 and 23')
+    return start_date, end_date, start_hour, end_hour, period
+
+def parse_data_form(data_type, form):
+    """Parameters of a /preview_data or /download_data request as a dict; ValueError says what is wrong"""
+    if data_type == 'time_range' or data_type == 'date_range':
+        start_date = form.get('start_date')
+        end_date = form.get('end_date')
+        
+        if not start_date or not end_date:
+            raise ValueError('Start date and end date are required')
+        
+        try:
+            datetime.strptime(start_date, '%Y-%m-%d')
+            datetime.strptime(end_date, '%Y-%m-%d')
+            start_hour = int(form.get('start_hour', '0'))
+            end_hour = int(form.get('end_hour', '23'))
+        except ValueError:
+            raise ValueError('Invalid date format. Use YYYY-MM-DD')
+        
+        if start_hour < 0 or start_hour > 23 or end_hour < 0 or end_hour > 23:
+            raise ValueError('Hours must be between 0 and 23')
+        return {'start_date': start_date, 'end_date': end_date, 'start_hour': start_hour, 'end_hour': end_hour}
+    
+    if data_type == 'hourly':
+        hours_from = form.get('hours_from')
+        hours_to = form.get('hours_to')
+        
+        if not hours_from or not hours_to:
+            raise ValueError('Hours from and to are required')
+        
+        try:
+            hours_from = int(hours_from)
+            hours_to = int(hours_to)
+        except ValueError:
+            raise ValueError('Hours must be integers')
+        
+        if hours_from < 0 or hours_from > 23 or hours_to < 0 or hours_to > 23:
+            raise ValueError('Hours must be between 0 and 23')
+        if hours_from >= hours_to:
+            raise ValueError('Start hour must be less than end hour')
+        return {'hours_from': hours_from, 'hours_to': hours_to}
+    
+    if data_type == 'rollup':
+        start_date, end_date, start_hour, end_hour, period = parse_rollup_form(form)
+        return {'start_date': start_date, 'end_date': end_date, 'start_hour': start_hour, 'end_hour': end_hour, 'period': period}
+    
+    if data_type == 'latest':
+        return {}
+    raise ValueError('Invalid data type')
+
+def data_version(data_type, mac, values):
+    """Version of the data a /preview_data or /download_data request reads, or None"""
+    try:
+        if data_type in ('time_range', 'date_range', 'rollup'):
+            datetime.strptime(values.get('start_date', ''), '%Y-%m-%d')
+            datetime.strptime(values.get('end_date', ''), '%Y-%m-%d')
+            return api_client.date_range_version(mac, values['start_date'], values['end_date'])
+        if data_type == 'hourly':
+            return api_client.hourly_version(mac, int(values.get('hours_from')), int(values.get('hours_to')))
+        if data_type == 'latest':
+            return api_client.latest_version(mac)
+    except (TypeError, ValueError):
+        pass  # the route reports the invalid request
+    return None
+
+def cache_validators(versions, relative=True):
+    """(etag, last modified, max age) of a GET response built from data at these versions
+
+    Raw readings carry hours_ago, so ``relative`` responses also change
+    whenever the hour turns, even if nothing new was stored.
+    """
+    now = datetime.now()
+    next_hour = floor_hour(now) + timedelta(hours=1)
+    seed = [request.path, sorted(request.values.items(multi=True)), [v['tag'] for v in versions]]
+    max_age = min(CLOSED_RANGE_MAX_AGE if v['max_age'] is None else v['max_age'] for v in versions)
+    modified = max((v['modified'] for v in versions if v['modified']), default=None)
+    
+    if relative:
+        seed.append(next_hour.isoformat())
+        max_age = min(max_age, int((next_hour - now).total_seconds()) + 1)
+        modified = max(modified or 0, floor_hour(now).timestamp())
+    
+    etag = hashlib.blake2b(json.dumps(seed, default=str).encode('utf-8'), digest_size=16).hexdigest()
+    last_modified = datetime.fromtimestamp(modified, timezone.utc) if modified else None
+    return etag, last_modified, max_age
+
+def request_validators(data_type, mac, version=None):
+    """Cache validators for a GET /preview_data or /download_data request, or None"""
+    if request.method != 'GET':
+        return None
+    version = version or data_version(data_type, mac, request.values)
+    if version is None:
+        return None
+    return cache_validators([version], relative=data_type not in ('rollup', 'latest'))
+
+def not_modified(validators):
+    """Whether the client's cached copy is still current"""
+    etag, last_modified, _ = validators
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    return bool(last_modified and since and last_modified.replace(microsecond=0) <= since)
+
+def with_cache_headers(response, validators, encoded=False):
+    """Add the validators to a response; ``encoded`` if its bytes depend on Accept-Encoding
+
+    The variants of an encoded response share one tag, which is therefore weak.
+    """
+    if encoded:
+        response.vary.add('Accept-Encoding')
+    if validators:
+        etag, last_modified, max_age = validators
+        response.set_etag(etag, weak=encoded)
+        if last_modified:
+            response.last_modified = last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    return response
+
+def content_disposition(filename):
+    """Content-Disposition offering a download under a filename, which may hold any characters
+
+    A name that is not plain ASCII goes out twice: with the accents dropped
+    for old clients and in full as an RFC 5987 ``filename*``.
+    """
+    options = {'filename': filename}
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        options['filename'] = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        options['filename*'] = "UTF-8''" + quote(filename, safe="!#$&+^`|")
+    return dump_options_header('attachment', options)
+
+def export_cache_key(data_type, mac, values, export_format, compression, version):
+    """(key, slot) of the cached file a /download_data request is served from, or None
+
+    The slot names the request whatever the data; the key adds the data
+    version and, for views with hours_ago, the current hour.
+    """
+    if api_client.exports is None or version is None or 'window' not in version:
+        return None
+    try:
+        if data_type == 'hourly':
+            params = [int(values['hours_from']), int(values['hours_to'])]
         else:
-            items.append((new_key, v))
-    return dict(items)
+            params = [values['start_date'], values['end_date'],
+                      int(values.get('start_hour', '0')), int(values.get('end_hour', '23'))]
+            if data_type == 'rollup':
+                params.append(values.get('period', 'day'))
+    except (KeyError, ValueError):
+        return None
+    
+    data_type = 'date_range' if data_type == 'time_range' else data_type
+    slot = artifact_key(data_type, mac.lower(), params, export_format, compression)
+    relative = [] if data_type == 'rollup' else [floor_hour(datetime.now()).isoformat()]
+    return artifact_key(slot, version['tag'], *relative), slot
 
-def convert_to_csv(data):
-    """Convert JSON data to CSV format"""
+def store_export(key, slot, df, export_format, compression, mac, window, filename):
+    if export_format == 'csv':
+        chunks = iter_csv([df])
+    else:
+        chunks = [frame_to_bytes(df, export_format, compression)]
+    api_client.exports.put(
+        key, chunks, api_client.exports.encodings_for(export_format == 'csv'), slot, mac, window, filename
+    )
+
+def cached_export(key, mimetype):
+    """Response sending a cached export in the best encoding the client takes, or None"""
+    accepted = [encoding for encoding in ('br', 'gzip') if request.accept_encodings[encoding]] + ['identity']
+    artifact = api_client.exports.get(key, accepted)
+    if artifact is None:
+        return None
+    
+    if artifact['decompress']:
+        response = Response(stream_with_context(iter_gunzip(artifact['path'])), mimetype=mimetype)
+    else:
+        response = send_file(artifact['path'], mimetype=mimetype, etag=False, conditional=False)
+        # Caching is up to with_cache_headers, as for built responses
+        response.cache_control.no_cache = None
+        if artifact['encoding'] != 'identity':
+            response.content_encoding = artifact['encoding']
+    response.headers['Content-Disposition'] = content_disposition(artifact['filename'])
+    return response
+
+def data_coverage(data_type, mac, values):
+    """Hour coverage of the stored window behind a /preview_data or /download_data response, or None"""
+    try:
+        if data_type in ('time_range', 'date_range', 'rollup'):
+            return api_client.date_range_coverage(mac, values['start_date'], values['end_date'])
+        if data_type == 'hourly':
+            return api_client.hourly_coverage(mac, int(values['hours_from']), int(values['hours_to']))
+    except Exception as e:
+        logger.warning("Error computing coverage: %s", e)
+    return None
+
+def with_coverage_header(response, coverage):
+    if coverage:
+        response.headers['X-Data-Coverage'] = '; '.join(f"{key}={value}" for key, value in coverage.items() if key != 'gaps')
+    return response
+
+def records_to_frame(data):
+    """Flatten JSON records into a DataFrame; returns None if nothing usable"""
+    # Columnar results are already flat and typed
+    if isinstance(data, pd.DataFrame):
+        return data if len(data) else None
+    
     if not data:
         return None
     
@@ -443,42 +1237,61 @@ def convert_to_csv(data):
     elif not isinstance(data, list):
         return None
     
-    # If empty list
-    if len(data) == 0:
-        return None
-    
     try:
-        # Flatten nested objects for CSV
-        flattened_data = []
-        for item in data:
-            if isinstance(item, dict):
-                flattened_item = flatten_nested_dict(item)
-                flattened_data.append(flattened_item)
-            else:
-                # Skip non-dict items
-                print(f"Skipping non-dict item: {type(item)}")
-                continue
-        
-        if not flattened_data:
-            return None
-        
-        # Create DataFrame
-        df = pd.DataFrame(flattened_data)
-        
-        # Handle datetime columns
-        for col in df.columns:
-            if 'timestamp' in col.lower() or 'time' in col.lower():
-                try:
-                    df[col] = pd.to_datetime(df[col], errors='ignore')
-                except:
-                    pass
-        
-        return df.to_csv(index=False)
-    
+        return records_frame(data)
     except Exception as e:
-        print(f"Error converting to CSV: {e}")
+        logger.warning("Error converting to CSV: %s", e)
         return None
 
+def convert_to_csv(data):
+    """Convert JSON data to CSV format"""
+    with timed('convert', CONVERSION_SECONDS, format='csv'):
+        df = records_to_frame(data)
+        return df.to_csv(index=False) if df is not None else None
+
+# Gauges read at scrape time from the state the API already keeps
+REGISTRY.gauge(
+    'airview_geocode_cache_hit_ratio', 'Share of geocode lookups answered from the cache'
+).set_function(lambda: api_client.geocode_cache.stats()['hit_ratio'])
+REGISTRY.gauge(
+    'airview_export_cache_bytes', 'Size of the cached export files on disk'
+).set_function(lambda: api_client.exports.stats()['bytes'] if api_client.exports is not None else None)
+REGISTRY.counter(
+    'airview_upstream_coalesced_calls_total', 'Upstream fetches asked for, by whether they shared another caller\'s request', ['result']
+).set_function(lambda: coalescing_counts(api_client.ainflight if isinstance(api_client, AsyncAirQualityAPI) else api_client.inflight))
+
+def coalescing_counts(inflight):
+    stats = inflight.stats()
+    return {('shared',): stats['shared'], ('fetched',): stats['calls'] - stats['shared']}
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc(endpoint=request.endpoint)
+    if SERVER_TIMING:
+        start_timing()
+
+@app.after_request
+def record_request_metrics(response):
+    elapsed = time.perf_counter() - g.request_started
+    REQUEST_SECONDS.observe(elapsed, endpoint=request.endpoint, method=request.method, status=response.status_code)
+    spans = stop_timing()
+    if spans is not None:
+        response.headers['Server-Timing'] = server_timing_header(spans, total=elapsed)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    stop_timing()
+    # Streamed responses get here once the stream has ended
+    if 'request_started' in g:
+        REQUESTS_IN_FLIGHT.dec(endpoint=request.endpoint)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics of this worker process"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     """Main page"""
@@ -488,7 +1301,96 @@ def index():
 def get_devices_api():
     """Get saved devices"""
     devices = api_client.get_saved_devices()
-    return jsonify(devices)
+    # Cheap to build but polled by every open page: let browsers revalidate instead of re-downloading
+    response = jsonify(devices)
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/api/upstream/latency')
+def upstream_latency():
+    """Per-endpoint latency of upstream calls made by this worker"""
+    if isinstance(api_client, AsyncAirQualityAPI):
+        upstream, inflight = api_client.aio, api_client.ainflight
+    else:
+        upstream, inflight = api_client.http, api_client.inflight
+    return jsonify({
+        'endpoints': upstream.latency_stats(),
+        'coalesced': inflight.stats(),
+        'geocode_cache': api_client.geocode_cache.stats()
+    })
+
+@app.route('/api/ingest/status')
+def ingest_status():
+    """Background ingestion state for this process"""
+    return jsonify(scheduler.status())
+
+@app.route('/api/alerts')
+def alerts_status():
+    """Alert rules, alerts firing now and recent alert events (in the ingesting process)"""
+    return jsonify(alert_engine.status())
+
+@app.route('/api/live')
+def live_readings():
+    """Stream new latest readings of devices as Server-Sent Events"""
+    macs = parse_mac_list(request.args.getlist('device_macs') + request.args.getlist('device_mac'))
+    if not macs or [m.lower() for m in macs] == ['all']:
+        macs = parse_mac_list(device['mac'] for device in api_client.get_saved_devices())
+    if not macs:
+        return jsonify({'error': 'No devices to watch'}), 400
+    
+    try:
+        subscription = live_feed.subscribe(macs)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 503
+    
+    # Each open stream holds a worker thread: run gunicorn with threaded workers (-k gthread)
+    return Response(
+        sse_events(subscription, heartbeat=LIVE_HEARTBEAT),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/live/status')
+def live_status():
+    """Devices watched by this worker and their subscriber counts"""
+    return jsonify(live_feed.status())
+
+@app.route('/api/fleet/snapshot')
+def fleet_snapshot():
+    """Latest reading, AQI level and freshness of every saved device, within a latency budget"""
+    try:
+        try:
+            budget = float(request.args.get('budget', FLEET_BUDGET))
+            if not budget > 0:
+                raise ValueError
+        except ValueError:
+            return jsonify({'error': 'Budget must be a positive number of seconds'}), 400
+        budget = min(budget, FLEET_MAX_BUDGET)
+        
+        started = time.perf_counter()
+        with timed('fetch'):
+            entries = fleet.snapshot(api_client.get_saved_devices(), budget)
+        RESPONSE_ROWS.observe(len(entries), endpoint='fleet_snapshot')
+        
+        counts = {status: 0 for status in ('fresh', 'stale', 'offline')}
+        for entry in entries:
+            counts[entry['status']] += 1
+        
+        response = jsonify(dict(
+            counts,
+            generated_at=datetime.now(timezone.utc).isoformat(),
+            budget_ms=round(budget * 1000),
+            elapsed_ms=round((time.perf_counter() - started) * 1000),
+            total=len(entries),
+            devices=entries
+        ))
+        # Polled by dashboards; every poll should see the newest readings
+        response.cache_control.no_store = True
+        return response
+    except Exception as e:
+        logger.exception("Fleet snapshot error: %s", e)
+        return jsonify({'error': f'Error: {str(e)}'}), 500
 
 @app.route('/api/devices/test', methods=['POST'])
 def test_device():
@@ -498,7 +1400,7 @@ def test_device():
         if not mac:
             return jsonify({'error': 'MAC address is required'}), 400
         
-        works, message = api_client.test_device(mac)
+        works, message, _ = api_client.probe_device(mac, refresh=True)
         return jsonify({
             'works': works,
             'message': message,
@@ -507,6 +1409,43 @@ def test_device():
     except Exception as e:
         return jsonify({'error': f'Error: {str(e)}'}), 500
 
+@app.route('/api/devices/test_batch', methods=['POST'])
+def test_devices_batch():
+    """Probe many MACs concurrently and stream one JSON line per device as it finishes"""
+    try:
+        macs = parse_mac_list(request.form.getlist('macs'))
+        save = request.form.get('save') in ('1', 'true', 'on')
+        refresh = request.form.get('refresh') in ('1', 'true', 'on')
+        
+        if not macs:
+            return jsonify({'error': 'At least one MAC address is required'}), 400
+        if len(macs) > MAX_PROBE_BATCH:
+            return jsonify({'error': f'At most {MAX_PROBE_BATCH} MAC addresses per batch'}), 400
+        
+        futures = {probe_executor.submit(api_client.probe_device, mac, refresh): mac for mac in macs}
+        
+        def results():
+            working = 0
+            for future in as_completed(futures):
+                mac = futures[future]
+                try:
+                    works, message, cached = future.result()
+                except Exception as e:
+                    works, message, cached = False, f"Error: {str(e)}", False
+                
+                line = {'mac': mac, 'works': works, 'message': message, 'cached': cached}
+                if works:
+                    working += 1
+                    if save:
+                        line['saved'] = api_client.save_device(mac)
+                yield json.dumps(line) + '\n'
+            
+            yield json.dumps({'done': True, 'total': len(macs), 'working': working}) + '\n'
+        
+        return Response(stream_with_context(results()), mimetype='application/x-ndjson')
+    except Exception as e:
+        return jsonify({'error': f'Error: {str(e)}'}), 500
+
 @app.route('/api/devices/save', methods=['POST'])
 def save_device():
     """Save a working device"""
@@ -517,8 +1456,8 @@ def save_device():
         if not mac:
             return jsonify({'error': 'MAC address is required'}), 400
         
-        # Test if the device works
-        works, message = api_client.test_device(mac)
+        # Test if the device works (a result from a test just before is reused)
+        works, message, _ = api_client.probe_device(mac)
         if not works:
             return jsonify({'error': f'Device test failed: {message}'}), 400
         
@@ -550,68 +1489,61 @@ def remove_device():
     except Exception as e:
         return jsonify({'error': f'Error: {str(e)}'}), 500
 
-@app.route('/download_data', methods=['POST'])
+@app.route('/download_data', methods=['GET', 'POST'])
 def download_data():
-    """Download data as CSV"""
+    """Download data as CSV, Parquet or Arrow IPC (Feather)"""
     try:
-        mac = request.form.get('device_mac')
-        data_type = request.form.get('data_type')
+        mac = request.values.get('device_mac')
+        data_type = request.values.get('data_type')
         
         if not mac:
             return jsonify({'error': 'Device MAC is required'}), 400
         
+        try:
+            export_format, compression = parse_export_format(
+                request.values.get('format'), request.values.get('compression')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        try:
+            params = parse_data_form(data_type, request.values)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Computing the version fetches what the store lacks, so only when validators or the export cache need it
+        version = None
+        if request.method == 'GET' or (api_client.exports is not None and data_type != 'latest'):
+            version = data_version(data_type, mac, request.values)
+        # A cached CSV goes out as brotli, gzip or identity depending on the request
+        encoded = export_format == 'csv' and api_client.exports is not None
+        validators = request_validators(data_type, mac, version)
+        if validators and not_modified(validators):
+            return with_cache_headers(Response(status=304), validators, encoded)
+        
+        mimetype, extension = EXPORT_FORMATS[export_format]
+        export = export_cache_key(data_type, mac, request.values, export_format, compression, version)
+        if export:
+            cached = cached_export(export[0], mimetype)
+            EXPORT_CACHE_LOOKUPS.inc(result='miss' if cached is None else 'hit')
+            if cached is not None:
+                coverage = data_coverage(data_type, mac, request.values)
+                return with_coverage_header(with_cache_headers(cached, validators, encoded), coverage)
+        
         data = None
         filename = f"air_quality_data_{mac}.csv"
         
         if data_type == 'time_range' or data_type == 'date_range':
-            start_date = request.form.get('start_date')
-            end_date = request.form.get('end_date')
-            start_hour = request.form.get('start_hour', '0')
-            end_hour = request.form.get('end_hour', '23')
-            
-            if not start_date or not end_date:
-                return jsonify({'error': 'Start date and end date are required'}), 400
-            
-            try:
-                # Validate date format
-                datetime.strptime(start_date, '%Y-%m-%d')
-                datetime.strptime(end_date, '%Y-%m-%d')
-                start_hour = int(start_hour)
-                end_hour = int(end_hour)
-                
-                if start_hour < 0 or start_hour > 23 or end_hour < 0 or end_hour > 23:
-                    return jsonify({'error': 'Hours must be between 0 and 23'}), 400
-                
-            except ValueError:
-                return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
-            
-            data = api_client.get_date_range_data(mac, start_date, end_date, start_hour, end_hour)
+            start_date, end_date = params['start_date'], params['end_date']
+            data = api_client.get_date_range_frame(mac, start_date, end_date, params['start_hour'], params['end_hour'])
             filename = f"date_range_data_{mac}_{start_date}_to_{end_date}.csv"
             
             if len(data) == 0:
                 return jsonify({'error': f'No data found for dates {start_date} to {end_date}. Try different dates.'}), 404
         
         elif data_type == 'hourly':
-            hours_from = request.form.get('hours_from')
-            hours_to = request.form.get('hours_to')
-            
-            if not hours_from or not hours_to:
-                return jsonify({'error': 'Hours from and to are required'}), 400
-            
-            try:
-                hours_from = int(hours_from)
-                hours_to = int(hours_to)
-                
-                if hours_from < 0 or hours_from > 23 or hours_to < 0 or hours_to > 23:
-                    return jsonify({'error': 'Hours must be between 0 and 23'}), 400
-                
-                if hours_from >= hours_to:
-                    return jsonify({'error': 'Start hour must be less than end hour'}), 400
-                
-            except ValueError:
-                return jsonify({'error': 'Hours must be integers'}), 400
-            
-            data = api_client.get_hourly_data(mac, hours_from, hours_to)
+            hours_from, hours_to = params['hours_from'], params['hours_to']
+            data = api_client.get_hourly_frame(mac, hours_from, hours_to)
             filename = f"hourly_data_{mac}_{hours_from}h_to_{hours_to}h.csv"
             
             if len(data) == 0:
@@ -625,88 +1557,266 @@ def download_data():
                 return jsonify({'error': 'No latest data found'}), 404
         
         else:
-            return jsonify({'error': 'Invalid data type'}), 400
+            start_date, end_date, period = params['start_date'], params['end_date'], params['period']
+            data = api_client.get_rollup_frame(mac, start_date, end_date, period, params['start_hour'], params['end_hour'])
+            filename = f"{period}_rollup_{mac}_{start_date}_to_{end_date}.csv"
+            
+            if len(data) == 0:
+                return jsonify({'error': f'No data found for dates {start_date} to {end_date}. Try different dates.'}), 404
         
         # Convert to CSV
-        csv_data = convert_to_csv(data)
-        if not csv_data:
+        df = records_to_frame(data)
+        if df is None:
             return jsonify({'error': 'Failed to convert data to CSV or no valid data found'}), 500
+        RESPONSE_ROWS.observe(len(df), endpoint='download_data')
+        coverage = data_coverage(data_type, mac, request.values)
+        filename = f"{filename.rsplit('.', 1)[0]}.{extension}"
+        
+        if export:
+            key, slot = export
+            try:
+                # Concurrent misses for the same file write it once
+                api_client.inflight.do(
+                    ('export', key), store_export, key, slot, df, export_format, compression, mac, version['window'], filename
+                )
+                cached = cached_export(key, mimetype)
+            except Exception as e:
+                logger.warning("Error caching export: %s", e)
+                cached = None
+            if cached is not None:
+                return with_coverage_header(with_cache_headers(cached, validators, encoded), coverage)
+        
+        if export_format != 'csv':
+            return with_coverage_header(with_cache_headers(Response(
+                frame_to_bytes(df, export_format, compression),
+                mimetype=mimetype,
+                headers={'Content-Disposition': content_disposition(filename)}
+            ), validators), coverage)
+        
+        # Stream the file in chunks instead of building it in memory
+        return with_coverage_header(with_cache_headers(Response(
+            stream_with_context(iter_csv([df])),
+            mimetype='text/csv',
+            headers={'Content-Disposition': content_disposition(filename)}
+        ), validators, encoded), coverage)
+    
+    except Exception as e:
+        logger.exception("Download error: %s", e)
+        return jsonify({'error': f'Error: {str(e)}'}), 500
+
+@app.route('/download_bulk', methods=['GET', 'POST'])
+def download_bulk():
+    """Download a date range for many devices as one file or a ZIP of per-device files"""
+    try:
+        macs = parse_mac_list(request.values.getlist('device_macs'))
+        
+        if not macs or [m.lower() for m in macs] == ['all']:
+            macs = parse_mac_list(device['mac'] for device in api_client.get_saved_devices())
+        
+        if not macs:
+            return jsonify({'error': 'No devices to export'}), 400
+        
+        start_date = request.values.get('start_date')
+        end_date = request.values.get('end_date')
+        start_hour = request.values.get('start_hour', '0')
+        end_hour = request.values.get('end_hour', '23')
+        layout = request.values.get('layout', 'merged')
+        
+        if not start_date or not end_date:
+            return jsonify({'error': 'Start date and end date are required'}), 400
+        
+        if layout not in ('merged', 'zip'):
+            return jsonify({'error': 'Layout must be "merged" or "zip"'}), 400
+        
+        try:
+            export_format, compression = parse_export_format(
+                request.values.get('format'), request.values.get('compression')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        mimetype, extension = EXPORT_FORMATS[export_format]
+        
+        try:
+            # Validate date format
+            datetime.strptime(start_date, '%Y-%m-%d')
+            datetime.strptime(end_date, '%Y-%m-%d')
+            start_hour = int(start_hour)
+            end_hour = int(end_hour)
+            
+            if start_hour < 0 or start_hour > 23 or end_hour < 0 or end_hour > 23:
+                return jsonify({'error': 'Hours must be between 0 and 23'}), 400
+            
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+        
+        futures = {
+            bulk_executor.submit(api_client.get_date_range_frame, mac, start_date, end_date, start_hour, end_hour): mac
+            for mac in macs
+        }
+        
+        def completed_frames():
+            """Yield (mac, frame) in completion order so the slowest device doesn't block the rest"""
+            for future in as_completed(futures):
+                mac = futures[future]
+                try:
+                    yield mac, future.result()
+                except Exception as e:
+                    logger.warning("Bulk export of %s failed: %s", mac, e)
+        
+        label = f"{len(macs)}_devices_{start_date}_to_{end_date}"
+        no_data = f'No data found for dates {start_date} to {end_date}. Try different dates.'
+        
+        if export_format != 'csv' and layout == 'merged':
+            # A columnar file has a single footer, so the merged variant is written once at the end
+            frames = [df for mac, df in completed_frames() if len(df)]
+            if not frames:
+                return jsonify({'error': no_data}), 404
+            return Response(
+                frame_to_bytes(pd.concat(frames, ignore_index=True), export_format, compression),
+                mimetype=mimetype,
+                headers={'Content-Disposition': content_disposition(f"bulk_data_{label}.{extension}")}
+            )
+        
+        # Wait for the first device with data before streaming, so an export with none can still be a 404
+        frames = ((mac, df) for mac, df in completed_frames() if len(df))
+        first = next(frames, None)
+        if first is None:
+            return jsonify({'error': no_data}), 404
+        frames = itertools.chain([first], frames)
         
-        # Create file buffer
-        csv_buffer = io.StringIO(csv_data)
-        csv_bytes = io.BytesIO(csv_buffer.getvalue().encode('utf-8'))
+        if layout == 'zip':
+            named_frames = (
+                (f"date_range_data_{mac.replace(':', '')}_{start_date}_to_{end_date}.{extension}", df)
+                for mac, df in frames
+            )
+            return Response(
+                stream_with_context(iter_zip(named_frames, export_format, compression)),
+                mimetype='application/zip',
+                headers={'Content-Disposition': content_disposition(f"bulk_data_{label}.zip")}
+            )
         
-        return send_file(
-            csv_bytes,
+        return Response(
+            stream_with_context(iter_csv(df for mac, df in frames)),
             mimetype='text/csv',
-            as_attachment=True,
-            download_name=filename
+            headers={'Content-Disposition': content_disposition(f"bulk_data_{label}.csv")}
         )
     
     except Exception as e:
-        print(f"Download error: {e}")
+        logger.exception("Bulk download error: %s", e)
         return jsonify({'error': f'Error: {str(e)}'}), 500
 
-@app.route('/preview_data', methods=['POST'])
+@app.route('/api/rollups', methods=['GET', 'POST'])
+def rollups():
+    """Daily or weekly AQI statistics for one or more devices over a date range"""
+    try:
+        macs = parse_mac_list(request.values.getlist('device_macs') + request.values.getlist('device_mac'))
+        if not macs:
+            return jsonify({'error': 'Device MAC is required'}), 400
+        
+        try:
+            start_date, end_date, start_hour, end_hour, period = parse_rollup_form(request.values)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        validators = None
+        if request.method == 'GET':
+            versions = list(bulk_executor.map(
+                lambda mac: api_client.date_range_version(mac, start_date, end_date), macs
+            ))
+            validators = cache_validators(versions, relative=False)
+            if not_modified(validators):
+                return with_cache_headers(Response(status=304), validators)
+        
+        frames = list(bulk_executor.map(
+            lambda mac: api_client.get_rollup_frame(mac, start_date, end_date, period, start_hour, end_hour),
+            macs
+        ))
+        frames = [df for df in frames if len(df)]
+        data = pd.concat(frames, ignore_index=True) if frames else empty_rollup_frame()
+        
+        RESPONSE_ROWS.observe(len(data), endpoint='rollups')
+        with timed('serialize', CONVERSION_SECONDS, format='json'):
+            body = preview_payload(data, compact=request.values.get('compact', '0').lower() in ('1', 'true', 'yes'))
+        return with_cache_headers(Response(body, mimetype='application/json'), validators)
+    
+    except Exception as e:
+        logger.exception("Rollup error: %s", e)
+        return jsonify({'error': f'Error: {str(e)}'}), 500
+
+@app.route('/api/coverage', methods=['GET', 'POST'])
+def coverage():
+    """What the local store holds for devices over a date range, with the runs of missing hours"""
+    try:
+        macs = parse_mac_list(request.values.getlist('device_macs') + request.values.getlist('device_mac'))
+        start_date = request.values.get('start_date')
+        end_date = request.values.get('end_date')
+        
+        if not macs:
+            return jsonify({'error': 'Device MAC is required'}), 400
+        if not start_date or not end_date:
+            return jsonify({'error': 'Start date and end date are required'}), 400
+        try:
+            datetime.strptime(start_date, '%Y-%m-%d')
+            datetime.strptime(end_date, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+        
+        # Reports the store as it is; nothing is fetched from the upstream
+        return jsonify({
+            'start_date': start_date,
+            'end_date': end_date,
+            'devices': [
+                dict(api_client.date_range_coverage(mac, start_date, end_date, gaps=True), mac=mac)
+                for mac in macs
+            ]
+        })
+    
+    except Exception as e:
+        logger.exception("Coverage error: %s", e)
+        return jsonify({'error': f'Error: {str(e)}'}), 500
+
+@app.route('/preview_data', methods=['GET', 'POST'])
 def preview_data():
-    """Preview data without downloading"""
+    """Preview data without downloading, one page at a time"""
     try:
-        mac = request.form.get('device_mac')
-        data_type = request.form.get('data_type')
+        mac = request.values.get('device_mac')
+        data_type = request.values.get('data_type')
         
         if not mac:
             return jsonify({'error': 'Device MAC is required'}), 400
         
+        try:
+            offset = int(request.values.get('offset', 0))
+            limit = int(request.values.get('limit', PREVIEW_PAGE_SIZE))
+            if offset < 0 or limit < 1:
+                raise ValueError
+        except ValueError:
+            return jsonify({'error': 'Offset must be >= 0 and limit >= 1'}), 400
+        
+        fields = [f.strip() for f in request.values.get('fields', '').split(',') if f.strip()]
+        compact = request.values.get('compact', '0').lower() in ('1', 'true', 'yes')
+        
+        try:
+            params = parse_data_form(data_type, request.values)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        validators = request_validators(data_type, mac)
+        if validators and not_modified(validators):
+            return with_cache_headers(Response(status=304), validators)
+        
         data = None
         
         if data_type == 'time_range' or data_type == 'date_range':
-            start_date = request.form.get('start_date')
-            end_date = request.form.get('end_date')
-            start_hour = request.form.get('start_hour', '0')
-            end_hour = request.form.get('end_hour', '23')
-            
-            if not start_date or not end_date:
-                return jsonify({'error': 'Start date and end date are required'}), 400
-            
-            try:
-                # Validate date format
-                datetime.strptime(start_date, '%Y-%m-%d')
-                datetime.strptime(end_date, '%Y-%m-%d')
-                start_hour = int(start_hour)
-                end_hour = int(end_hour)
-                
-                if start_hour < 0 or start_hour > 23 or end_hour < 0 or end_hour > 23:
-                    return jsonify({'error': 'Hours must be between 0 and 23'}), 400
-                
-            except ValueError:
-                return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
-            
-            data = api_client.get_date_range_data(mac, start_date, end_date, start_hour, end_hour)
+            start_date, end_date = params['start_date'], params['end_date']
+            data = api_client.get_date_range_frame(mac, start_date, end_date, params['start_hour'], params['end_hour'])
             
             if len(data) == 0:
                 return jsonify({'error': f'No data found for dates {start_date} to {end_date}. Try different dates.'}), 404
         
         elif data_type == 'hourly':
-            hours_from = request.form.get('hours_from')
-            hours_to = request.form.get('hours_to')
-            
-            if not hours_from or not hours_to:
-                return jsonify({'error': 'Hours from and to are required'}), 400
-            
-            try:
-                hours_from = int(hours_from)
-                hours_to = int(hours_to)
-                
-                if hours_from < 0 or hours_from > 23 or hours_to < 0 or hours_to > 23:
-                    return jsonify({'error': 'Hours must be between 0 and 23'}), 400
-                
-                if hours_from >= hours_to:
-                    return jsonify({'error': 'Start hour must be less than end hour'}), 400
-                
-            except ValueError:
-                return jsonify({'error': 'Hours must be integers'}), 400
-            
-            data = api_client.get_hourly_data(mac, hours_from, hours_to)
+            hours_from, hours_to = params['hours_from'], params['hours_to']
+            data = api_client.get_hourly_frame(mac, hours_from, hours_to)
             
             if len(data) == 0:
                 return jsonify({'error': f'No data found for hours {hours_from} to {hours_to}. Try a different time range.'}), 404
@@ -718,20 +1828,26 @@ def preview_data():
                 return jsonify({'error': 'No latest data found'}), 404
         
         else:
-            return jsonify({'error': 'Invalid data type'}), 400
+            start_date, end_date = params['start_date'], params['end_date']
+            data = api_client.get_rollup_frame(
+                mac, start_date, end_date, params['period'], params['start_hour'], params['end_hour']
+            )
+            
+            if len(data) == 0:
+                return jsonify({'error': f'No data found for dates {start_date} to {end_date}. Try different dates.'}), 404
         
-        # Return all data for preview
-        preview_data = data if isinstance(data, list) else [data]
-        total_records = len(data) if isinstance(data, list) else 1
+        # Return the requested page of the data
+        if not isinstance(data, pd.DataFrame):
+            data = pd.DataFrame(data if isinstance(data, list) else [data])
         
-        return jsonify({
-            'success': True,
-            'data': preview_data,
-            'total_records': total_records
-        })
+        RESPONSE_ROWS.observe(len(data), endpoint='preview_data')
+        coverage = data_coverage(data_type, mac, request.values)
+        with timed('serialize', CONVERSION_SECONDS, format='json'):
+            body = preview_payload(data, offset, limit, fields, compact, coverage)
+        return with_coverage_header(with_cache_headers(Response(body, mimetype='application/json'), validators), coverage)
     
     except Exception as e:
-        print(f"Preview error: {e}")
+        logger.exception("Preview error: %s", e)
         return jsonify({'error': f'Error: {str(e)}'}), 500
 
 if __name__ == '__main__':
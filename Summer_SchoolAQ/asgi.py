@@ -0,0 +1,128 @@
+"""ASGI entry point: upstream waits on the event loop, Flask in a thread pool
+
+    UPSTREAM_MODE=async uvicorn asgi:application --workers 4
+
+Under a WSGI server every request holds a worker thread for as long as the
+airview API takes to answer it. Here the routes that go upstream for one or
+more devices (/preview_data, /download_data, /download_bulk, /api/rollups
+and /api/devices/test) first have that part awaited on the process's shared
+asyncio loop, which fills the local store, device context and probe cache
+without holding a thread. Flask then serves the request on one of
+ASGI_THREADS threads and finds what it needs locally. Every other route goes
+straight to Flask; /api/devices/test_batch, /api/fleet/snapshot and
+/api/live keep their own thread pools.
+
+Without UPSTREAM_MODE=async the app is only served through the thread pool.
+"""
+import asyncio
+import logging
+import os
+from urllib.parse import parse_qsl
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import MultiDict
+
+import app
+
+logger = logging.getLogger(__name__)
+
+# Threads running Flask; with the upstream part done, they only wait on local stores
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+# Request bodies read to find a POST's devices; a longer one is passed on without prefetching
+MAX_PREFETCH_BODY = 64 * 1024
+
+PREFETCH_ROUTES = ('/preview_data', '/download_data', '/download_bulk', '/api/rollups', '/api/devices/test')
+FORM_TYPE = b'application/x-www-form-urlencoded'
+
+
+def replay(messages, receive):
+    """receive() that returns already read messages first, then reads on"""
+    messages = list(messages)
+
+    async def replayed():
+        if messages:
+            return messages.pop(0)
+        return await receive()
+    return replayed
+
+
+async def read_form(scope, receive):
+    """(messages read, values) of a request: query string and, if urlencoded, the body
+
+    Messages is None if the client went away. values is None if the body
+    was too long to read here.
+    """
+    messages, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None, None
+        messages.append(message)
+        size += len(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+        if size > MAX_PREFETCH_BODY:
+            return messages, None
+
+    pairs = parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True)
+    content_type = dict(scope['headers']).get(b'content-type', b'').split(b';')[0].strip().lower()
+    if content_type == FORM_TYPE:
+        body = b''.join(message.get('body', b'') for message in messages)
+        pairs += parse_qsl(body.decode('utf-8', 'replace'), keep_blank_values=True)
+    return messages, MultiDict(pairs)
+
+
+class UpstreamPrefetch:
+    """Awaits a request's upstream part on the API's shared loop, then hands the request to a WSGI app"""
+
+    def __init__(self, wsgi, api):
+        self.wsgi = wsgi
+        self.api = api
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] in PREFETCH_ROUTES:
+            messages, values = await read_form(scope, receive)
+            if messages is None:
+                return
+            if values is not None:
+                try:
+                    await self.api.loop.wait(self._prefetch(scope['path'], values))
+                except Exception as e:
+                    # Flask still serves the request, fetching in its thread what is missing
+                    logger.warning("Prefetch for %s failed: %s", scope['path'], e)
+            receive = replay(messages, receive)
+        await self.wsgi(scope, receive, send)
+
+    async def _prefetch(self, path, values):
+        """Do a request's upstream part, reading its devices and parameters as its route does"""
+        if path == '/api/devices/test':
+            if values.get('mac'):
+                await self.api.aprefetch_probe(values['mac'])
+            return
+
+        if path == '/download_bulk':
+            data_type = 'date_range'
+            macs = app.parse_mac_list(values.getlist('device_macs'))
+            if not macs or [mac.lower() for mac in macs] == ['all']:
+                saved = await asyncio.to_thread(self.api.get_saved_devices)
+                macs = app.parse_mac_list(device['mac'] for device in saved)
+        elif path == '/api/rollups':
+            data_type = 'rollup'
+            macs = app.parse_mac_list(values.getlist('device_macs') + values.getlist('device_mac'))
+        else:
+            data_type = values.get('data_type')
+            macs = [values['device_mac']] if values.get('device_mac') else []
+        try:
+            params = app.parse_data_form(data_type, values)
+        except ValueError:
+            # Flask answers it with a 400
+            return
+        await asyncio.gather(*(self.api.aprefetch_data(mac, data_type, params) for mac in macs))
+
+
+wsgi = WSGIMiddleware(app.app, workers=ASGI_THREADS)
+if isinstance(app.api_client, app.AsyncAirQualityAPI):
+    application = UpstreamPrefetch(wsgi, app.api_client)
+else:
+    logger.warning("UPSTREAM_MODE is not async: upstream waits hold the Flask threads")
+    application = wsgi
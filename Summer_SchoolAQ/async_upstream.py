@@ -0,0 +1,198 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+try:
+    import httpx
+except ImportError:  # async upstream mode is optional
+    httpx = None
+
+from observability import UPSTREAM_IN_FLIGHT, UPSTREAM_RESPONSES, UPSTREAM_SECONDS
+
+
+class AsyncUpstreamClient:
+    """asyncio HTTP client for upstream calls, with a concurrency cap per host
+
+    Mirrors UpstreamClient: pooled keep-alive connections, (connect, read)
+    timeouts, bounded retries with exponential backoff on 5xx and failed
+    connects (not on read timeouts), and per-endpoint latency. Must be used from a single event loop.
+    """
+
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, pool_size=100, per_host_limit=50, connect_timeout=3.05,
+                 read_timeout=30, max_retries=2, backoff_factor=0.5):
+        if httpx is None:
+            raise RuntimeError("Async upstream mode requires the httpx package")
+
+        self.pool_size = pool_size
+        self.per_host_limit = per_host_limit
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        self._client = None
+        self._client_loop = None
+        self._host_limits = {}
+        self._lock = threading.Lock()
+        self._latency = {}
+
+    def _bound_client(self):
+        # Connections and semaphores belong to one loop (a forked worker gets a new one)
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client_loop = loop
+            self._host_limits = {}
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size
+                )
+            )
+        return self._client
+
+    def _host_limit(self, url):
+        host = urlsplit(url).netloc
+        semaphore = self._host_limits.get(host)
+        if semaphore is None:
+            semaphore = self._host_limits[host] = asyncio.Semaphore(self.per_host_limit)
+        return semaphore
+
+    async def get(self, url, endpoint, timeout=None, params=None):
+        """GET a URL and record its latency under the given endpoint name"""
+        read_timeout = timeout if timeout is not None else self.read_timeout
+        timeouts = httpx.Timeout(read_timeout, connect=self.connect_timeout)
+
+        client = self._bound_client()
+        UPSTREAM_IN_FLIGHT.inc(endpoint=endpoint)
+        status = 'error'
+        start = time.perf_counter()
+        try:
+            async with self._host_limit(url):
+                for attempt in range(self.max_retries + 1):
+                    last_attempt = attempt == self.max_retries
+                    try:
+                        response = await client.get(url, params=params, timeout=timeouts)
+                    except (httpx.ConnectError, httpx.ConnectTimeout):
+                        if last_attempt:
+                            raise
+                    else:
+                        if response.status_code not in self.RETRY_STATUSES or last_attempt:
+                            status = response.status_code
+                            return response
+                    await asyncio.sleep(self.backoff_factor * 2 ** attempt)
+        finally:
+            UPSTREAM_IN_FLIGHT.dec(endpoint=endpoint)
+            UPSTREAM_RESPONSES.inc(endpoint=endpoint, status=status)
+            self._record_latency(endpoint, time.perf_counter() - start)
+
+    def _record_latency(self, endpoint, seconds):
+        UPSTREAM_SECONDS.observe(seconds, endpoint=endpoint)
+        with self._lock:
+            stats = self._latency.setdefault(endpoint, {'count': 0, 'total': 0.0, 'max': 0.0})
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+
+    def latency_stats(self):
+        """Per-endpoint request count and latency in milliseconds"""
+        with self._lock:
+            return {
+                endpoint: {
+                    'count': stats['count'],
+                    'avg_ms': round(stats['total'] / stats['count'] * 1000, 1),
+                    'max_ms': round(stats['max'] * 1000, 1)
+                }
+                for endpoint, stats in self._latency.items()
+            }
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of cache.SingleFlight, for use on a single loop
+
+    Followers await the leader's task through a shield, so a caller that
+    gives up does not cancel the fetch for everyone else.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._loop = None
+        self._stats = {'calls': 0, 'shared': 0}
+
+    async def do(self, key, factory):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._calls = loop, {}
+
+        self._stats['calls'] += 1
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = loop.create_task(factory())
+            task.add_done_callback(functools.partial(self._forget, key))
+        else:
+            self._stats['shared'] += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def stats(self):
+        return dict(self._stats, in_flight=len(self._calls))
+
+
+class EventLoopThread:
+    """One asyncio loop per process, running in a daemon thread
+
+    Lets synchronous Flask handlers hand upstream I/O to a shared loop:
+    the handler thread only waits on a future, while the loop multiplexes
+    every in-flight upstream request over one connection pool. An ASGI
+    server's own loop awaits work on it with ``wait``.
+    """
+
+    def __init__(self, name='upstream-loop'):
+        self.name = name
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        pid = os.getpid()
+        if self._loop is None or self._pid != pid:
+            with self._lock:
+                if self._loop is None or self._pid != pid:
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(target=loop.run_forever, name=self.name, daemon=True)
+                    thread.start()
+                    self._loop, self._pid = loop, pid
+        return self._loop
+
+    def in_loop(self):
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the shared loop and wait for its result"""
+        if self.in_loop():
+            coro.close()
+            raise RuntimeError("EventLoopThread.run() called from inside its own loop")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    async def wait(self, coro):
+        """Run a coroutine on the shared loop and await its result from another loop"""
+        if self.in_loop():
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
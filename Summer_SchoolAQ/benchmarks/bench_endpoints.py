@@ -0,0 +1,339 @@
+"""Benchmark preview_data, download_data and convert_to_csv against the mock airview
+
+Starts the mock upstream, points the app at it with fresh stores in a
+temporary directory, then runs each scenario over --devices MACs with
+--days of hourly history (24 * days hours per device), --concurrency
+requests at a time. Reports throughput, p50/p99 latency, mean response
+size, error rate, peak RSS of the process and the most upstream requests
+the mock saw in flight at once.
+
+Scenarios run in this order, so each one sees the stores the previous ones
+filled:
+    preview-cold      first preview page of every device, fetched upstream
+    preview-warm      the same pages again, served from the local store
+    download-csv      full date range as streamed CSV
+    download-repeat   the same CSV again, gzip accepted, from the export cache
+    download-parquet  full date range as Parquet
+    convert-csv       convert_to_csv on one device's worth of raw readings
+
+Peak RSS is the high-water mark of the whole run so far; run a single
+scenario with --only to see its own footprint.
+
+By default requests go through Flask's test client in this process.
+--server runs the app in a server process instead and sends it real HTTP
+requests: gunicorn with --threads threads (the sync upstream client), or
+uvicorn serving asgi.py (UPSTREAM_MODE=async) with as many Flask threads.
+Peak RSS is then the server's, and convert-csv is skipped. To see how many
+slow cold previews each keeps in flight:
+
+    python benchmarks/bench_endpoints.py --server gunicorn --only preview-cold \
+        --devices 300 --days 7 --concurrency 300 --latency 0.5
+    python benchmarks/bench_endpoints.py --server uvicorn ...
+
+--json writes the results; --compare reads such a file and exits with
+status 1 when a scenario's p50 or p99 got slower than --tolerance allows.
+
+Usage: python benchmarks/bench_endpoints.py --devices 50 --days 90 --latency 0.05
+"""
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from mock_airview import MockAirviewServer  # noqa: E402
+
+SCENARIOS = ('preview-cold', 'preview-warm', 'download-csv', 'download-repeat', 'download-parquet', 'convert-csv')
+
+# Upstream mode and command line of each --server; one worker process so its RSS and threads are comparable
+SERVERS = {
+    'gunicorn': ('sync', ['-m', 'gunicorn', '--workers', '1', '--threads', '{threads}', '--timeout', '300',
+                          '--log-level', 'warning', '--bind', '127.0.0.1:{port}', 'app:app']),
+    'uvicorn': ('async', ['-m', 'uvicorn', '--host', '127.0.0.1', '--port', '{port}', '--log-level', 'warning',
+                          '--no-access-log', 'asgi:application'])
+}
+
+
+def app_environ(server, workdir, days):
+    """Environment pointing the app at the mock upstream and throwaway stores"""
+    return {
+        'AIRVIEW_API_URL': server.url,
+        'GEOCODE_API_URL': f"{server.url}/reverse-geocode",
+        'HISTORY_DB': os.path.join(workdir, 'history.sqlite3'),
+        'GEOCODE_CACHE_DB': os.path.join(workdir, 'geocode.sqlite3'),
+        'DEVICES_DB': os.path.join(workdir, 'devices.sqlite3'),
+        'LEGACY_DEVICES_FILE': os.path.join(workdir, 'saved_devices.json'),
+        'INGEST_LOCK_FILE': os.path.join(workdir, 'ingest.lock'),
+        'EXPORT_CACHE_DIR': os.path.join(workdir, 'export_cache'),
+        'INGEST_ENABLED': '0',
+        # Let the mock's 24h endpoint serve the whole benchmarked history
+        'MAX_UPSTREAM_HOURS': str(max(days * 24, 168)),
+        'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'ERROR')
+    }
+
+
+def load_app(server, workdir, days):
+    """Import app configured for the mock upstream and throwaway stores"""
+    os.environ.update(app_environ(server, workdir, days))
+    import app
+    return app
+
+
+def start_server(kind, environ, threads):
+    """Run the app under --server kind; returns (process, base URL) once it answers"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    mode, args = SERVERS[kind]
+    env = dict(os.environ, **environ, UPSTREAM_MODE=mode, ASGI_THREADS=str(threads))
+    command = [sys.executable] + [arg.format(port=port, threads=threads) for arg in args]
+    process = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL)
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            requests.get(f"{url}/metrics", timeout=5)
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    process.wait(30)
+    raise RuntimeError(f"{kind} did not start answering on {url} (exit status {process.returncode})")
+
+
+def server_peak_rss_mb(pid):
+    """High-water marks of a server process and its workers, where /proc has them"""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids = [pid] + [int(child) for child in f.read().split()]
+        total = 0
+        for process in pids:
+            with open(f"/proc/{process}/status") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+        return total / 1024
+    except (OSError, StopIteration):
+        return 0.0
+
+
+def peak_rss_mb(pid=None):
+    if pid is not None:
+        return server_peak_rss_mb(pid)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_requests(calls, concurrency, pid=None):
+    """Run calls that return (ok, size), concurrency at a time; returns the scenario stats"""
+    def timed_call(fn):
+        started = time.perf_counter()
+        try:
+            ok, size = fn()
+        except Exception:
+            ok, size = False, 0
+        return time.perf_counter() - started, ok, size
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed_call, calls))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _, _ in results)
+    errors = sum(1 for _, ok, _ in results if not ok)
+    return {
+        'requests': len(results),
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(results) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'mean_bytes': round(sum(size for _, _, size in results) / len(results)) if results else 0,
+        'error_rate': round(errors / len(results), 4) if results else 0.0,
+        'peak_rss_mb': round(peak_rss_mb(pid), 1)
+    }
+
+
+def test_client_requests(app):
+    """Factory of calls sending a GET through Flask's test client"""
+    def http_call(path, params, headers=None):
+        def call():
+            client = app.app.test_client()
+            response = client.get(path, query_string=params, headers=headers)
+            try:
+                # Streamed bodies are produced while being read, so read them inside the timing
+                body = response.get_data()
+                return response.status_code < 400, len(body)
+            finally:
+                response.close()
+        return call
+    return http_call
+
+
+def server_requests(url, concurrency):
+    """Factory of calls sending a GET to a server, counting the bytes as sent"""
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(pool_maxsize=concurrency))
+
+    def http_call(path, params, headers=None):
+        def call():
+            # requests asks for gzip unless told otherwise; the test client asks for nothing
+            response = session.get(f"{url}{path}", params=params, headers=dict({'Accept-Encoding': 'identity'}, **(headers or {})),
+                                   stream=True, timeout=300)
+            try:
+                body = response.raw.read(decode_content=False)
+                return response.status_code < 400, len(body)
+            finally:
+                response.close()
+        return call
+    return http_call
+
+
+def convert_call(app, records):
+    def call():
+        csv = app.convert_to_csv(records)
+        return csv is not None, len(csv or '')
+    return call
+
+
+def raw_readings(server, mac, hours):
+    """One latest-style reading per hour, the shape convert_to_csv gets from the upstream"""
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    template = server.latest(mac)
+    readings = []
+    for i, value in enumerate(server.series(mac, hours)):
+        reading = dict(template, calculatedAqi=value)
+        reading['timestamp'] = (now - timedelta(hours=hours - 1 - i)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        readings.append(reading)
+    return readings
+
+
+def build_calls(scenario, http_call, app, server, macs, days):
+    end = date.today()
+    date_range = {
+        'data_type': 'date_range',
+        'start_date': (end - timedelta(days=days - 1)).isoformat(),
+        'end_date': end.isoformat()
+    }
+    if scenario in ('preview-cold', 'preview-warm'):
+        return [http_call('/preview_data', dict(date_range, device_mac=mac)) for mac in macs]
+    if scenario in ('download-csv', 'download-parquet'):
+        export_format = scenario.split('-')[1]
+        return [http_call('/download_data', dict(date_range, device_mac=mac, format=export_format)) for mac in macs]
+    if scenario == 'download-repeat':
+        return [http_call('/download_data', dict(date_range, device_mac=mac, format='csv'), {'Accept-Encoding': 'gzip'})
+                for mac in macs]
+    # Built up front so only the conversion is timed
+    return [convert_call(app, raw_readings(server, mac, days * 24)) for mac in macs]
+
+
+def compare(results, baseline, tolerance):
+    """Print p50/p99 changes against a baseline run; returns the scenarios that regressed"""
+    regressed = []
+    print(f"\nAgainst baseline (tolerance {tolerance:.0%}):")
+    for scenario, stats in results.items():
+        before = baseline.get(scenario)
+        if not before:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p99_ms'):
+            change = (stats[key] - before[key]) / before[key] if before[key] else 0.0
+            changes.append(f"{key[:3]} {change:+.0%}")
+            if change > tolerance:
+                regressed.append(scenario)
+        print(f"  {scenario:<17} {'  '.join(changes)}")
+    return sorted(set(regressed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=50)
+    parser.add_argument('--days', type=int, default=90, help='days of hourly history per device')
+    parser.add_argument('--concurrency', type=int, default=8, help='requests in flight at once')
+    parser.add_argument('--latency', type=float, default=0.05, help='mock upstream latency, seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of upstream requests answered 503')
+    parser.add_argument('--extra-fields', type=int, default=0, help='nested sensor channels per latest reading')
+    parser.add_argument('--only', choices=SCENARIOS, action='append', help='run only these scenarios (repeatable)')
+    parser.add_argument('--server', choices=sorted(SERVERS), help='serve the app from this server instead of the test client')
+    parser.add_argument('--threads', type=int, default=8, help='request threads of the --server process')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='baseline results file from an earlier --json run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p50/p99 slowdown against --compare')
+    args = parser.parse_args()
+
+    server = MockAirviewServer(
+        latency=args.latency, error_rate=args.error_rate, extra_fields=args.extra_fields
+    ).start()
+    macs = [f"BE:00:00:00:{i // 256:02X}:{i % 256:02X}" for i in range(args.devices)]
+    scenarios = [s for s in SCENARIOS if not args.only or s in args.only]
+    if args.server:
+        # Converting runs in this process, not behind a server
+        scenarios = [s for s in scenarios if s != 'convert-csv']
+
+    served_by = f"{args.server}, {args.threads} threads" if args.server else 'test client'
+    print(f"{args.devices} devices x {args.days * 24} hours, concurrency {args.concurrency}, "
+          f"upstream latency {args.latency}s, error rate {args.error_rate:.1%}, {served_by}")
+    print(f"  {'scenario':<17} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'bytes':>10} {'errors':>7} {'peak MB':>8} "
+          f"{'upstream':>9}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        process = app = None
+        if args.server:
+            process, url = start_server(args.server, app_environ(server, workdir, args.days), args.threads)
+        else:
+            app = load_app(server, workdir, args.days)
+        try:
+            for scenario in scenarios:
+                # New connections per scenario: the server may have closed those left idle by the last one
+                http_call = server_requests(url, args.concurrency) if process else test_client_requests(app)
+                upstream_before = server.requests
+                server.peak_in_flight = 0
+                calls = build_calls(scenario, http_call, app, server, macs, args.days)
+                stats = run_requests(calls, args.concurrency, process.pid if process else None)
+                stats['upstream_requests'] = server.requests - upstream_before
+                stats['upstream_peak_in_flight'] = server.peak_in_flight
+                results[scenario] = stats
+                print(f"  {scenario:<17} {stats['throughput']:8.1f} {stats['p50_ms']:9.1f} {stats['p99_ms']:9.1f} "
+                      f"{stats['mean_bytes']:10d} {stats['error_rate']:7.1%} {stats['peak_rss_mb']:8.1f} "
+                      f"{stats['upstream_peak_in_flight']:9d}")
+        finally:
+            if process:
+                process.terminate()
+                process.wait(30)
+
+    server.stop()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressed = compare(results, baseline, args.tolerance)
+        if regressed:
+            print(f"Regressed: {', '.join(regressed)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Local stand-in for the airview API and the reverse-geocode service
+
+Serves:
+    /api/v1/data-intake/<mac>            latest reading (dict)
+    /api/v1/data-intake-24h/<mac>/<n>    n hourly AQI values, -1 for gaps
+    /reverse-geocode                     bigdatacloud-style location
+
+Latency, error rate and the size of the latest reading (--extra-fields nested
+sensor channels) are configurable.
+
+Usage: python mock_airview.py --port 8765 --latency 0.2 --error-rate 0.01
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+
+class MockAirviewServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port=0, latency=0.0, jitter=0.0, error_rate=0.0, gap_rate=0.1, extra_fields=0):
+        super().__init__(('127.0.0.1', port), MockAirviewHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.gap_rate = gap_rate
+        self.extra_fields = extra_fields
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='mock-airview', daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def series(self, mac, hours):
+        # Deterministic per device so repeated runs return the same data
+        rng = random.Random(zlib.crc32(mac.encode()) + hours)
+        return [-1 if rng.random() < self.gap_rate else rng.randint(5, 250) for _ in range(hours)]
+
+    def latest(self, mac):
+        rng = random.Random(zlib.crc32(mac.encode()))
+        reading = {
+            'mac': mac,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'calculatedAqi': rng.randint(5, 250),
+            'pm25': round(rng.uniform(1, 80), 1),
+            'pm10': round(rng.uniform(1, 120), 1),
+            't': round(rng.uniform(-5, 35), 1),
+            'lat': round(45.70 + rng.random() * 0.1, 4),
+            'lng': round(21.18 + rng.random() * 0.1, 4)
+        }
+        if self.extra_fields:
+            reading['channels'] = {f'ch{i}': round(rng.uniform(0, 100), 2) for i in range(self.extra_fields)}
+        return reading
+
+
+class MockAirviewHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server._lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+        try:
+            delay = server.latency + random.uniform(0, server.jitter)
+            if delay > 0:
+                time.sleep(delay)
+            if random.random() < server.error_rate:
+                return self._send(503, {'error': 'mock failure'})
+            self._route(urlsplit(self.path).path.strip('/').split('/'))
+        finally:
+            with server._lock:
+                server.in_flight -= 1
+
+    def _route(self, parts):
+        if parts[:3] == ['api', 'v1', 'data-intake-24h'] and len(parts) == 5:
+            mac, hours = unquote(parts[3]), int(parts[4])
+            return self._send(200, self.server.series(mac, hours))
+        if parts[:3] == ['api', 'v1', 'data-intake'] and len(parts) == 4:
+            return self._send(200, self.server.latest(unquote(parts[3])))
+        if parts == ['reverse-geocode']:
+            return self._send(200, {
+                'locality': 'Timisoara',
+                'principalSubdivision': 'Timis',
+                'countryName': 'Romania'
+            })
+        return self._send(404, {'error': 'not found'})
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random latency, seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered 503')
+    parser.add_argument('--gap-rate', type=float, default=0.1, help='fraction of hours reported as -1')
+    parser.add_argument('--extra-fields', type=int, default=0, help='nested sensor channels added to the latest reading')
+    args = parser.parse_args()
+
+    server = MockAirviewServer(
+        args.port, args.latency, args.jitter, args.error_rate, args.gap_rate, args.extra_fields
+    )
+    print(f"Mock airview listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
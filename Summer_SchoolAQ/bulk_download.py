@@ -0,0 +1,224 @@
+"""Export a date range for many devices to partitioned files, without the web server
+
+Fetches each device through the same AirQualityAPI the Flask routes use
+(local history first, the upstream for whatever it lacks), --workers
+devices at a time, and writes one file per device and partition:
+
+    OUT/<mac without colons>/<month, day or whole range>.<csv|parquet|arrow>
+
+Progress is checkpointed to OUT/checkpoint.json after every device, so an
+interrupted run started again with the same arguments skips the devices
+already written. A device whose fetchable hours did not all arrive is
+reported as failed and retried by the next run; the exit status is 1 while
+any device failed. Devices default to the saved devices.
+
+Usage: python bulk_download.py --start-date 2025-01-01 --end-date 2025-01-31 --out archive/
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+# A cron job must not start the ingestion scheduler configured for the web app
+os.environ['INGEST_ENABLED'] = '0'
+
+import app  # noqa: E402
+from devices import normalize_mac  # noqa: E402
+from records import EXPORT_FORMATS, frame_to_bytes, iter_csv, parse_export_format  # noqa: E402
+
+logger = logging.getLogger('bulk_download')
+
+PARTITIONS = ('month', 'day', 'none')
+# Characters of the 'date' column (YYYY-MM-DD) that name a partition
+PARTITION_KEY_LENGTH = {'month': 7, 'day': 10}
+CHECKPOINT_FILE = 'checkpoint.json'
+
+
+def read_devices_file(path):
+    """MACs from a saved_devices.json-style list, or a text file with one or more per line"""
+    with open(path, 'r') as f:
+        text = f.read()
+    try:
+        devices = json.loads(text)
+    except ValueError:
+        return app.parse_mac_list(line.split('#')[0] for line in text.splitlines())
+    return app.parse_mac_list(device['mac'] if isinstance(device, dict) else device for device in devices)
+
+
+def partitions(df, partition, start_date, end_date):
+    """Yield (name, frame) for each file a device's frame is split into"""
+    if partition == 'none':
+        yield f"{start_date}_to_{end_date}", df
+        return
+    keys = df['date'].astype(str).str[:PARTITION_KEY_LENGTH[partition]]
+    for key, part in df.groupby(keys, sort=True):
+        yield key, part
+
+
+def write_file(path, df, export_format, compression):
+    """Write a frame as a whole file; readers never see a partly written one"""
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp, 'wb') as f:
+            if export_format == 'csv':
+                for chunk in iter_csv([df]):
+                    f.write(chunk.encode('utf-8'))
+            else:
+                f.write(frame_to_bytes(df, export_format, compression))
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class Checkpoint:
+    """Devices finished by a job, kept in a JSON file rewritten after each one"""
+
+    def __init__(self, path, job):
+        self.path = path
+        self.job = job
+        self.completed = {}
+
+    def load(self):
+        """Pick up a previous run of the same job; ValueError if the file belongs to another job"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as f:
+            state = json.load(f)
+        if state.get('job') != self.job:
+            raise ValueError(f"{self.path} was written by a run with other arguments: {state.get('job')}")
+        self.completed = state.get('completed', {})
+
+    def done(self, mac):
+        return normalize_mac(mac) in self.completed
+
+    def complete(self, mac, result):
+        self.completed[normalize_mac(mac)] = dict(result, finished_at=datetime.now().isoformat(timespec='seconds'))
+        self._save()
+
+    def _save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump({'job': self.job, 'completed': self.completed}, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+def export_device(mac, job, out):
+    """Fetch one device's range and write its partitions; returns {'rows', 'files'}"""
+    df = app.api_client.get_date_range_frame(mac, job['start_date'], job['end_date'], job['start_hour'], job['end_hour'])
+    if not app.api_client.date_range_fetched(mac, job['start_date'], job['end_date']):
+        raise RuntimeError('the upstream did not return every hour it still serves')
+
+    _, extension = EXPORT_FORMATS[job['format']]
+    directory = os.path.join(out, normalize_mac(mac).replace(':', ''))
+    files = []
+    if len(df):
+        os.makedirs(directory, exist_ok=True)
+        for name, part in partitions(df, job['partition'], job['start_date'], job['end_date']):
+            path = os.path.join(directory, f"{name}.{extension}")
+            write_file(path, part, job['format'], job['compression'])
+            files.append(os.path.relpath(path, out))
+    return {'rows': len(df), 'files': files}
+
+
+def run(macs, job, out, workers, checkpoint):
+    """Export every device not finished yet; returns the MACs that failed"""
+    pending = [mac for mac in macs if not checkpoint.done(mac)]
+    logger.info("%s devices, %s already exported, %s to go", len(macs), len(macs) - len(pending), len(pending))
+
+    failed = []
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk')
+    try:
+        futures = {executor.submit(export_device, mac, job, out): mac for mac in pending}
+        for i, future in enumerate(as_completed(futures), 1):
+            mac = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.warning("[%s/%s] %s failed: %s", i, len(pending), mac, e)
+                failed.append(mac)
+                continue
+            checkpoint.complete(mac, result)
+            logger.info("[%s/%s] %s: %s rows in %s files", i, len(pending), mac, result['rows'], len(result['files']))
+    finally:
+        # On Ctrl-C, drop the queued devices instead of fetching them first
+        executor.shutdown(wait=True, cancel_futures=True)
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', action='append', default=[], help='MACs, comma or space separated (repeatable)')
+    parser.add_argument('--devices-file', help='saved_devices.json-style list, or a text file of MACs')
+    parser.add_argument('--start-date', required=True, help='YYYY-MM-DD')
+    parser.add_argument('--end-date', required=True, help='YYYY-MM-DD')
+    parser.add_argument('--start-hour', type=int, default=0)
+    parser.add_argument('--end-hour', type=int, default=23)
+    parser.add_argument('--format', default='csv', help='csv, parquet or feather')
+    parser.add_argument('--compression', help='parquet/feather codec')
+    parser.add_argument('--partition', choices=PARTITIONS, default='month', help='one file per device and month, day or none')
+    parser.add_argument('--workers', type=int, default=app.BULK_EXPORT_WORKERS, help='devices fetched at once')
+    parser.add_argument('--out', required=True, help='output directory, also holding the checkpoint')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and export every device again')
+    args = parser.parse_args()
+
+    try:
+        start = datetime.strptime(args.start_date, '%Y-%m-%d')
+        end = datetime.strptime(args.end_date, '%Y-%m-%d')
+    except ValueError:
+        parser.error('Invalid date format. Use YYYY-MM-DD')
+    if start > end:
+        parser.error('Start date must not be after end date')
+    if not (0 <= args.start_hour <= 23 and 0 <= args.end_hour <= 23):
+        parser.error('Hours must be between 0 and 23')
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    try:
+        export_format, compression = parse_export_format(args.format, args.compression)
+    except ValueError as e:
+        parser.error(str(e))
+
+    macs = app.parse_mac_list(args.devices)
+    if args.devices_file:
+        macs = app.parse_mac_list(macs + read_devices_file(args.devices_file))
+    if not args.devices and not args.devices_file:
+        macs = app.parse_mac_list(device['mac'] for device in app.api_client.get_saved_devices())
+    if not macs:
+        parser.error('No devices to export')
+
+    job = {
+        'start_date': args.start_date,
+        'end_date': args.end_date,
+        'start_hour': args.start_hour,
+        'end_hour': args.end_hour,
+        'format': export_format,
+        'compression': compression,
+        'partition': args.partition
+    }
+    os.makedirs(args.out, exist_ok=True)
+    checkpoint = Checkpoint(os.path.join(args.out, CHECKPOINT_FILE), job)
+    if not args.restart:
+        try:
+            checkpoint.load()
+        except ValueError as e:
+            parser.error(f"{e}; use --restart or another --out")
+
+    try:
+        failed = run(macs, job, args.out, args.workers, checkpoint)
+    except KeyboardInterrupt:
+        logger.warning("Interrupted; run again with the same arguments to resume")
+        sys.exit(130)
+
+    if failed:
+        logger.warning("%s devices failed and will be retried by the next run: %s", len(failed), ', '.join(failed))
+        sys.exit(1)
+    logger.info("All %s devices exported to %s", len(macs), args.out)
+
+
+if __name__ == '__main__':
+    main()
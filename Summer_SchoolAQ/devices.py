@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('mac', 'name', 'added_date', 'last_tested')
+
+
+def normalize_mac(mac):
+    return mac.strip().lower()
+
+
+class DeviceRegistry:
+    """Saved devices in SQLite, keyed by normalized MAC
+
+    Every write is a single upsert or delete, so gunicorn workers can save
+    and remove devices at the same time without losing each other's
+    changes. On first use the devices of the old ``saved_devices.json``
+    file are imported once.
+    """
+
+    def __init__(self, db_path, legacy_file=None):
+        self.db_path = db_path
+        self.legacy_file = legacy_file
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        # WAL makes NORMAL durable enough and avoids an fsync per commit
+        conn.execute('PRAGMA synchronous=NORMAL')
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS devices ('
+                ' mac_key TEXT PRIMARY KEY,'
+                ' mac TEXT NOT NULL,'
+                ' name TEXT NOT NULL,'
+                ' added_date TEXT NOT NULL,'
+                ' last_tested TEXT)'
+            )
+
+        with self._connect() as conn:
+            # Only the first worker to get here imports; user_version marks it done
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute('PRAGMA user_version').fetchone()[0] == 0:
+                self._import_legacy(conn)
+                conn.execute('PRAGMA user_version = 1')
+
+    def _import_legacy(self, conn):
+        if not self.legacy_file or not os.path.exists(self.legacy_file):
+            return
+        try:
+            with open(self.legacy_file, 'r') as f:
+                devices = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not import %s: %s", self.legacy_file, e)
+            return
+
+        rows = [
+            (normalize_mac(d['mac']), d['mac'], d.get('name') or f"Device {d['mac']}",
+             d.get('added_date') or datetime.now().isoformat(), d.get('last_tested'))
+            for d in devices if isinstance(d, dict) and d.get('mac')
+        ]
+        conn.executemany(
+            'INSERT OR IGNORE INTO devices (mac_key, mac, name, added_date, last_tested) VALUES (?, ?, ?, ?, ?)',
+            rows
+        )
+        logger.info("Imported %s devices from %s", len(rows), self.legacy_file)
+
+    def all(self):
+        """Saved devices in the order they were added"""
+        with self._connect() as conn:
+            rows = conn.execute(f'SELECT {", ".join(FIELDS)} FROM devices ORDER BY rowid').fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, mac):
+        with self._connect() as conn:
+            row = conn.execute(
+                f'SELECT {", ".join(FIELDS)} FROM devices WHERE mac_key = ?', (normalize_mac(mac),)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def save(self, mac, name=None):
+        """Add a device or rename and re-stamp an existing one"""
+        now = datetime.now().isoformat()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO devices (mac_key, mac, name, added_date, last_tested) VALUES (?, ?, ?, ?, ?)'
+                ' ON CONFLICT (mac_key) DO UPDATE SET'
+                ' name = COALESCE(?, name), last_tested = excluded.last_tested',
+                (normalize_mac(mac), mac, name or f"Device {mac}", now, now, name or None)
+            )
+
+    def remove(self, mac):
+        """Delete a device; returns False if it was not saved"""
+        with self._connect() as conn:
+            cursor = conn.execute('DELETE FROM devices WHERE mac_key = ?', (normalize_mac(mac),))
+        return cursor.rowcount > 0
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM devices').fetchone()[0]
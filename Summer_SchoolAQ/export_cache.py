@@ -0,0 +1,259 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import brotli
+except ImportError:  # brotli variants are simply not stored
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Preferred first when the client accepts several
+ENCODINGS = ('br', 'gzip', 'identity')
+EXTENSIONS = {'br': '.br', 'gzip': '.gz', 'identity': ''}
+
+# Last-use times closer together than this are not rewritten on every hit
+TOUCH_INTERVAL = 60
+
+
+def artifact_key(*parts):
+    """Content address of an export: a hash of everything its bytes depend on"""
+    return hashlib.blake2b(json.dumps(parts, default=str).encode('utf-8'), digest_size=20).hexdigest()
+
+
+class _GzipFile(gzip.GzipFile):
+    """Write-only gzip file whose header names no file and no time
+
+    Keeps the temp file name and mtime out of the bytes sent to clients, so
+    the same export always compresses to the same bytes.
+    """
+
+    def __init__(self, path, compresslevel=6):
+        self._file = open(path, 'wb')
+        super().__init__(filename='', mode='wb', fileobj=self._file, compresslevel=compresslevel, mtime=0)
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._file.close()
+
+
+class _BrotliFile:
+    """Write-only file that brotli-compresses what is written to it"""
+
+    def __init__(self, path, quality=5):
+        self._file = open(path, 'wb')
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def write(self, data):
+        self._file.write(self._compressor.process(data))
+
+    def close(self):
+        self._file.write(self._compressor.finish())
+        self._file.close()
+
+
+class ExportCache:
+    """Disk cache of finished export files, shared by all worker processes
+
+    Each artifact is stored under its content address (see ``artifact_key``)
+    in one or more encodings: text exports as gzip and, when the brotli
+    package is installed, brotli; columnar exports, which compress
+    internally, as is. A SQLite index records size and last use, so the
+    cache is trimmed least recently used first to ``max_bytes``, and which
+    device and hours each artifact covers, so ingesting new hours drops the
+    artifacts built from the old ones.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.db_path = os.path.join(directory, 'index.sqlite3')
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        # WAL makes NORMAL durable enough and avoids an fsync per commit
+        conn.execute('PRAGMA synchronous=NORMAL')
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS artifacts ('
+                ' key TEXT NOT NULL,'
+                ' encoding TEXT NOT NULL,'
+                ' slot TEXT NOT NULL,'
+                ' mac TEXT NOT NULL,'
+                ' first_hour TEXT NOT NULL,'
+                ' last_hour TEXT NOT NULL,'
+                ' filename TEXT NOT NULL,'
+                ' size INTEGER NOT NULL,'
+                ' last_used REAL NOT NULL,'
+                ' PRIMARY KEY (key, encoding))'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS artifacts_mac ON artifacts (mac, first_hour, last_hour)')
+            conn.execute('CREATE INDEX IF NOT EXISTS artifacts_last_used ON artifacts (last_used)')
+
+    def _path(self, key, encoding):
+        return os.path.join(self.directory, key[:2], key + EXTENSIONS[encoding])
+
+    def encodings_for(self, compressible):
+        if not compressible:
+            return ['identity']
+        return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    def get(self, key, accepted):
+        """The stored variant to send as {'path', 'encoding', 'decompress', 'filename'}, or None
+
+        ``accepted`` are the encodings the client takes. A client taking
+        neither stored compression gets the gzip variant with 'decompress'
+        set; the caller decompresses it while sending.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT encoding, last_used, filename FROM artifacts WHERE key = ?', (key,)
+            ).fetchall()
+            if not rows:
+                return None
+            stored = {encoding: last_used for encoding, last_used, _ in rows}
+
+            encoding = next((e for e in ENCODINGS if e in stored and e in accepted), None)
+            decompress = encoding is None
+            if decompress:
+                if 'gzip' not in stored:
+                    return None
+                encoding = 'gzip'
+
+            path = self._path(key, encoding)
+            if not os.path.exists(path):
+                # Evicted by another process between its index update and ours
+                conn.execute('DELETE FROM artifacts WHERE key = ? AND encoding = ?', (key, encoding))
+                return None
+
+            now = time.time()
+            if now - stored[encoding] > TOUCH_INTERVAL:
+                conn.execute('UPDATE artifacts SET last_used = ? WHERE key = ?', (now, key))
+        return {
+            'path': path,
+            'encoding': 'identity' if decompress else encoding,
+            'decompress': decompress,
+            'filename': rows[0][2]
+        }
+
+    def put(self, key, chunks, encodings, slot, mac, window, filename):
+        """Store an export given as text or byte chunks, in each of ``encodings``
+
+        ``slot`` names what was asked for regardless of data version (device,
+        range, format); artifacts of the same slot under another key are
+        outdated and dropped. ``window`` is the (first, last) hour the export
+        was built from.
+        """
+        tmp = f".{uuid.uuid4().hex}.tmp"
+        paths = {encoding: self._path(key, encoding) for encoding in encodings}
+        os.makedirs(os.path.dirname(paths[encodings[0]]), exist_ok=True)
+        writers = {encoding: _open_writer(path + tmp, encoding) for encoding, path in paths.items()}
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                for writer in writers.values():
+                    writer.write(chunk)
+        except BaseException:
+            for encoding, writer in writers.items():
+                writer.close()
+                os.remove(paths[encoding] + tmp)
+            raise
+        for writer in writers.values():
+            writer.close()
+
+        now = time.time()
+        rows = []
+        for encoding, path in paths.items():
+            os.replace(path + tmp, path)
+            rows.append((key, encoding, slot, mac.lower(), str(window[0]), str(window[1]), filename,
+                         os.path.getsize(path), now))
+
+        with self._connect() as conn:
+            outdated = conn.execute(
+                'SELECT key, encoding FROM artifacts WHERE slot = ? AND key != ?', (slot, key)
+            ).fetchall()
+            self._delete(conn, outdated)
+            conn.executemany(
+                'INSERT OR REPLACE INTO artifacts'
+                ' (key, encoding, slot, mac, first_hour, last_hour, filename, size, last_used)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            self._evict(conn)
+
+    def invalidate(self, mac, first_hour, last_hour):
+        """Drop a device's artifacts built from any hour between two hours"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT key, encoding FROM artifacts WHERE mac = ? AND first_hour <= ? AND last_hour >= ?',
+                (mac.lower(), str(last_hour), str(first_hour))
+            ).fetchall()
+            self._delete(conn, rows)
+        return len(rows)
+
+    def _evict(self, conn):
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM artifacts').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for key, encoding, size in conn.execute('SELECT key, encoding, size FROM artifacts ORDER BY last_used'):
+            if total <= self.max_bytes:
+                break
+            victims.append((key, encoding))
+            total -= size
+        self._delete(conn, victims)
+        logger.debug("Evicted %s export artifacts", len(victims))
+
+    def _delete(self, conn, rows):
+        if not rows:
+            return
+        conn.executemany('DELETE FROM artifacts WHERE key = ? AND encoding = ?', rows)
+        for key, encoding in rows:
+            try:
+                os.remove(self._path(key, encoding))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._connect() as conn:
+            count, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts').fetchone()
+        return {'artifacts': count, 'bytes': size, 'max_bytes': self.max_bytes}
+
+
+def _open_writer(path, encoding):
+    if encoding == 'gzip':
+        return _GzipFile(path)
+    if encoding == 'br':
+        return _BrotliFile(path)
+    return open(path, 'wb')
+
+
+def iter_gunzip(path, chunk_size=64 * 1024):
+    """Yield the decompressed content of a gzip file"""
+    with gzip.open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
@@ -0,0 +1,124 @@
+import functools
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+AQI_FIELDS = ('calculatedAqi', 'dustAqi', 'iaq')
+
+
+class FleetSnapshot:
+    """Latest reading of many devices at once, answered within a latency budget
+
+    Devices are fetched concurrently through ``api.get_device_data``, which
+    answers from the short-lived per-device context cache while it is
+    fresh. A device that has not answered when the budget runs out is
+    reported from its last stored reading and marked stale instead of
+    holding up the response; its fetch keeps running, warms the cache, and
+    is picked up rather than started again by the next snapshot.
+    """
+
+    def __init__(self, api, max_workers=32, stale_after=3600, fallback_max_age=86400):
+        self.api = api
+        self.stale_after = stale_after
+        self.fallback_max_age = fallback_max_age
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fleet')
+
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _submit(self, mac):
+        records = self.api.peek_device_data(mac)
+        if records is not None:
+            # Cached devices must not queue behind the fetches of slow ones
+            future = Future()
+            future.set_result(records)
+            return future
+
+        key = mac.lower()
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = self._pending[key] = self.executor.submit(self.api.get_device_data, mac)
+        # Outside the lock: the callback runs right away if the fetch already finished
+        future.add_done_callback(functools.partial(self._forget, key))
+        return future
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def snapshot(self, devices, budget):
+        """Entries for saved devices (dicts with 'mac' and 'name'), in order, within ``budget`` seconds"""
+        futures = [self._submit(device['mac']) for device in devices]
+        wait(futures, timeout=budget)
+        now = datetime.now(timezone.utc)
+
+        results = [_result(future) for future in futures]
+        missing = [device['mac'] for device, (reading, _) in zip(devices, results) if reading is None]
+        last_known = self._last_known(missing) if missing else {}
+        return [
+            self._entry(device, reading or last_known.get(device['mac'].lower()), reason, now)
+            for device, (reading, reason) in zip(devices, results)
+        ]
+
+    def _entry(self, device, reading, reason, now):
+        entry = {'mac': device['mac'], 'name': device.get('name')}
+        if reading is None:
+            entry.update(status='offline', reason=reason, aqi=None, aqi_level='No Data',
+                         timestamp=None, age_seconds=None, location=None)
+            return entry
+
+        aqi = next((reading[field] for field in AQI_FIELDS if (reading.get(field) or 0) > 0), None)
+        timestamp = reading.get('timestamp')
+        age = _age_seconds(timestamp, now)
+        if reason is None and age is not None and age > self.stale_after:
+            reason = 'old_reading'
+
+        entry.update(
+            status='stale' if reason else 'fresh',
+            reason=reason,
+            aqi=aqi,
+            aqi_level=reading.get('aqi_level') or self.api.get_aqi_level(aqi),
+            timestamp=timestamp,
+            age_seconds=age,
+            location=reading.get('location')
+        )
+        return entry
+
+    def _last_known(self, macs):
+        """Stored readings to fall back on, keyed by lowercased MAC"""
+        try:
+            return self.api.history.load_latest_many(macs, self.fallback_max_age)
+        except Exception as e:
+            logger.warning("Error loading last known readings: %s", e)
+            return {}
+
+
+def _result(future):
+    """(reading, None) for a device that answered, else (None, why not)"""
+    if not future.done():
+        return None, 'timeout'
+    if future.exception() is not None:
+        return None, 'error'
+    records = future.result()
+    if records and isinstance(records[0], dict):
+        return records[0], None
+    return None, 'no_data'
+
+
+def _age_seconds(timestamp, now):
+    """Seconds since an ISO 8601 reading timestamp (UTC if it has no offset), or None"""
+    if not isinstance(timestamp, str) or not timestamp:
+        return None
+    try:
+        parsed = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return max(0, round((now - parsed).total_seconds()))
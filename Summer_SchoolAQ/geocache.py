@@ -0,0 +1,124 @@
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from cache import TTLCache
+from observability import GEOCODE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+
+class GeocodeCache:
+    """Two-tier (memory LRU + SQLite) cache of reverse-geocoded locations
+
+    Keys are coordinates rounded to ``precision`` decimals (3 is ~100 m).
+    A ``None`` location is a negative entry: the lookup failed recently and
+    should not be retried until ``negative_ttl`` has passed.
+    """
+
+    def __init__(self, db_path, precision=3, ttl=30 * 86400, negative_ttl=600, memory_size=4096):
+        self.db_path = db_path
+        self.precision = precision
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = TTLCache(maxsize=memory_size, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        # WAL makes NORMAL durable enough and avoids an fsync per commit
+        conn.execute('PRAGMA synchronous=NORMAL')
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        try:
+            with self._connect() as conn:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS geocode ('
+                    ' lat REAL NOT NULL,'
+                    ' lng REAL NOT NULL,'
+                    ' location TEXT,'
+                    ' expires_at REAL NOT NULL,'
+                    ' PRIMARY KEY (lat, lng))'
+                )
+        except sqlite3.Error as e:
+            logger.info("Geocode cache disabled on disk: %s", e)
+            self.db_path = None
+
+    def key(self, lat, lng):
+        return round(float(lat), self.precision), round(float(lng), self.precision)
+
+    def lookup(self, lat, lng):
+        """Return (found, location); location is None for a cached failure"""
+        key = self.key(lat, lng)
+        entry = self.memory.get(key)
+        if entry is not None:
+            self._count(hit=True)
+            return True, entry[0]
+
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    row = conn.execute(
+                        'SELECT location, expires_at FROM geocode WHERE lat = ? AND lng = ?', key
+                    ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning("Error reading geocode cache: %s", e)
+                row = None
+
+            if row is not None:
+                location, expires_at = row
+                remaining = expires_at - time.time()
+                if remaining > 0:
+                    # Wrap in a tuple so negative entries are distinguishable from misses
+                    self.memory.set(key, (location,), ttl=remaining)
+                    self._count(hit=True)
+                    return True, location
+
+        self._count(hit=False)
+        return False, None
+
+    def store(self, lat, lng, location):
+        """Cache a resolved location, or a failure when location is None"""
+        key = self.key(lat, lng)
+        ttl = self.ttl if location is not None else self.negative_ttl
+        self.memory.set(key, (location,), ttl=ttl)
+
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO geocode (lat, lng, location, expires_at) VALUES (?, ?, ?, ?)',
+                        (key[0], key[1], location, time.time() + ttl)
+                    )
+            except sqlite3.Error as e:
+                logger.warning("Error writing geocode cache: %s", e)
+
+    def _count(self, hit):
+        GEOCODE_LOOKUPS.inc(result='hit' if hit else 'miss')
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else None,
+                'memory_entries': len(self.memory)
+            }
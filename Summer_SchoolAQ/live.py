@@ -0,0 +1,145 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """One client's view of the live feed: a bounded queue of (mac, reading)"""
+
+    def __init__(self, feed, macs, maxsize=100):
+        self.feed = feed
+        self.macs = macs
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, item):
+        # A client that stopped reading loses its oldest readings, not the poller's time
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout):
+        """Next (mac, reading), or None if nothing arrived within timeout seconds"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.feed.unsubscribe(self)
+
+
+class LiveFeed:
+    """Pushes new latest readings of devices to any number of subscribers
+
+    Each watched device has exactly one poller thread in this process, no
+    matter how many clients subscribe to it. The poller fetches the latest
+    reading every ``interval`` seconds, fans it out only when it changed,
+    and stops once the last subscriber of the device has gone.
+    """
+
+    def __init__(self, api, interval=60, max_devices=500):
+        self.api = api
+        self.interval = interval
+        self.max_devices = max_devices
+
+        self._subscribers = {}
+        self._pollers = {}
+        self._last = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(mac):
+        return mac.lower()
+
+    def subscribe(self, macs):
+        """Start watching devices; raises ValueError when too many are watched already"""
+        subscription = Subscription(self, macs)
+        with self._lock:
+            new = {self._key(mac) for mac in macs} - set(self._subscribers)
+            if len(self._subscribers) + len(new) > self.max_devices:
+                raise ValueError(f"At most {self.max_devices} devices can be watched at once")
+
+            for mac in macs:
+                key = self._key(mac)
+                self._subscribers.setdefault(key, set()).add(subscription)
+                if key in self._last:
+                    # Late subscribers start from the last reading instead of waiting a full interval
+                    subscription.put((mac, self._last[key]))
+                if key not in self._pollers:
+                    stop = threading.Event()
+                    thread = threading.Thread(target=self._poll, args=(mac, stop), name=f'live-{key}', daemon=True)
+                    self._pollers[key] = stop
+                    thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for mac in subscription.macs:
+                key = self._key(mac)
+                subscribers = self._subscribers.get(key)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[key]
+                    self._last.pop(key, None)
+                    self._pollers.pop(key).set()
+
+    def _poll(self, mac, stop):
+        key = self._key(mac)
+        last_payload = None
+        while not stop.is_set():
+            try:
+                records = self.api.get_device_data(mac, refresh=True)
+                payload = json.dumps(records, sort_keys=True, default=str)
+                if records and payload != last_payload and not stop.is_set():
+                    last_payload = payload
+                    self._publish(key, mac, records[0])
+            except Exception as e:
+                logger.warning("Live poll of %s failed: %s", mac, e)
+            stop.wait(self.interval)
+
+    def _publish(self, key, mac, reading):
+        with self._lock:
+            if key not in self._subscribers:
+                return
+            self._last[key] = reading
+            subscribers = list(self._subscribers[key])
+        for subscription in subscribers:
+            subscription.put((mac, reading))
+
+    def status(self):
+        with self._lock:
+            return {
+                'interval': self.interval,
+                'devices': {key: len(subscribers) for key, subscribers in self._subscribers.items()}
+            }
+
+
+def sse_events(subscription, heartbeat=15):
+    """Yield Server-Sent Events for a subscription until the client goes away"""
+    try:
+        yield f"retry: {heartbeat * 1000}\n\n"
+        last_sent = time.monotonic()
+        while True:
+            item = subscription.get(timeout=heartbeat)
+            if item is not None:
+                mac, reading = item
+                yield f"event: reading\ndata: {json.dumps(dict(reading, mac=mac), default=str)}\n\n"
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= heartbeat:
+                # Comment line: keeps proxies from closing the stream and surfaces dead clients
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+    finally:
+        subscription.close()
@@ -0,0 +1,249 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Metric:
+    """A named family of samples, one per combination of label values
+
+    ``set_function`` replaces the stored samples by a callback evaluated at
+    scrape time; it returns a number, or a dict of label-value tuples to
+    numbers for labelled metrics.
+    """
+
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._function = None
+        self._lock = threading.Lock()
+
+    def _labels(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def set_function(self, function):
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            value = self._function()
+            values = value if isinstance(value, dict) else {(): value}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            if value is not None:
+                yield self.name, dict(zip(self.labelnames, labels)), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._labels(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._labels(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", dict(labels, le=_format_value(bound)), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    """Metrics of this process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, labelnames=(), **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+REGISTRY = Registry()
+
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    'airview_upstream_request_seconds', 'Upstream request latency, retries included', ['endpoint']
+)
+UPSTREAM_RESPONSES = REGISTRY.counter(
+    'airview_upstream_responses_total', 'Upstream requests by final HTTP status ("error" if none)', ['endpoint', 'status']
+)
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge('airview_upstream_in_flight', 'Upstream requests in progress', ['endpoint'])
+GEOCODE_LOOKUPS = REGISTRY.counter('airview_geocode_cache_lookups_total', 'Geocode cache lookups', ['result'])
+EXPORT_CACHE_LOOKUPS = REGISTRY.counter('airview_export_cache_lookups_total', 'Export cache lookups', ['result'])
+CONVERSION_SECONDS = REGISTRY.histogram(
+    'airview_conversion_seconds', 'Time spent serializing data for a response', ['format']
+)
+RESPONSE_ROWS = REGISTRY.histogram(
+    'airview_response_rows', 'Records per data response', ['endpoint'],
+    buckets=(0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+)
+REQUESTS_IN_FLIGHT = REGISTRY.gauge('airview_http_requests_in_flight', 'HTTP requests being served', ['endpoint'])
+REQUEST_SECONDS = REGISTRY.histogram(
+    'airview_http_request_seconds', 'HTTP request duration until the handler returned', ['endpoint', 'method', 'status']
+)
+
+# Server-Timing spans of the request being handled in this thread, or None when off
+_spans = ContextVar('server_timing_spans', default=None)
+
+
+def start_timing():
+    _spans.set([])
+
+
+def stop_timing():
+    spans = _spans.get()
+    _spans.set(None)
+    return spans
+
+
+@contextmanager
+def timed(name, histogram=None, **labels):
+    """Time a block as a Server-Timing span (when timing is on) and into a histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((name, elapsed))
+        if histogram is not None:
+            histogram.observe(elapsed, **labels)
+
+
+def server_timing_header(spans, total=None):
+    """Server-Timing header value; spans with the same name are summed"""
+    durations = {}
+    for name, seconds in spans:
+        durations[name] = durations.get(name, 0.0) + seconds
+    if total is not None:
+        durations['total'] = total
+    return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items())
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers"""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_logging(level='INFO', fmt='text'):
+    handler = logging.StreamHandler()
+    if fmt == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+    # httpx logs every request at INFO; per-request detail belongs in the metrics
+    logging.getLogger('httpx').setLevel(logging.WARNING)
@@ -0,0 +1,415 @@
+import io
+import json
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from observability import CONVERSION_SECONDS, timed
+
+# Upper bounds of each AQI band; values above the last bound are Hazardous
+AQI_BOUNDS = np.array([50, 100, 150, 200, 300])
+AQI_LEVELS = np.array([
+    'Good',
+    'Moderate',
+    'Unhealthy for Sensitive Groups',
+    'Unhealthy',
+    'Very Unhealthy',
+    'Hazardous',
+    'No Data'
+], dtype=object)
+
+DAY_NAMES = np.array(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'], dtype=object)
+HOUR_TIMES = np.array([f'{h:02d}:00:00' for h in range(24)], dtype=object)
+HOUR_LABELS = np.array([f'{h:02d}:00' for h in range(24)], dtype=object)
+
+# format name -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'feather': ('application/vnd.apache.arrow.file', 'arrow')
+}
+FORMAT_ALIASES = {'arrow': 'feather', 'ipc': 'feather'}
+COMPRESSIONS = {
+    'parquet': ('snappy', 'zstd', 'gzip', 'brotli', 'lz4', 'none'),
+    'feather': ('lz4', 'zstd', 'uncompressed')
+}
+DEFAULT_COMPRESSION = {'parquet': 'snappy', 'feather': 'zstd'}
+
+# Low-cardinality text columns stored as dictionaries in columnar exports
+CATEGORICAL_COLUMNS = ('mac', 'aqi_level', 'day_of_week', 'measurement_type', 'data_source', 'location')
+FLOAT_COLUMNS = ('aqi', 'calculatedAqi', 'latitude', 'longitude')
+
+HOURLY_COLUMNS = [
+    'mac', 'timestamp', 'date', 'time', 'hour', 'day_of_week', 'aqi', 'calculatedAqi',
+    'aqi_level', 'measurement_type', 'data_source', 'location', 'latitude', 'longitude',
+    'hours_ago', 'real_timestamp', 'note'
+]
+
+ROLLUP_PERIODS = ('day', 'week')
+# Hours spent in each AQI band, one column per level
+LEVEL_COLUMNS = ['hours_' + level.lower().replace(' ', '_') for level in AQI_LEVELS[:-1]]
+ROLLUP_COLUMNS = [
+    'mac', 'period', 'period_start', 'location', 'readings', 'expected_hours', 'coverage',
+    'aqi_mean', 'aqi_min', 'aqi_max', 'aqi_p95'
+] + LEVEL_COLUMNS
+
+# Record shapes the API builds itself, recognized by their exact set of keys
+RECORD_SCHEMAS = {frozenset(columns): columns for columns in (HOURLY_COLUMNS, ROLLUP_COLUMNS)}
+# Text columns of upstream readings parsed as datetimes, with their format;
+# 'date', 'time' and 'real_timestamp' only look like they belong here
+DATETIME_FORMATS = {'timestamp': 'ISO8601'}
+
+
+def aqi_levels(values):
+    """Vectorized get_aqi_level: map an array of AQI values to level names"""
+    values = np.asarray(values, dtype=float)
+    index = np.searchsorted(AQI_BOUNDS, values, side='left')
+    index[np.isnan(values) | (values < 0)] = len(AQI_LEVELS) - 1
+    return AQI_LEVELS[index]
+
+
+def hourly_frame(mac, hours, values, context, current_hour, measurement_type,
+                 data_source, note_prefix, hour_from=0, hour_to=23):
+    """Build hourly reading records as columns
+
+    ``hours`` is a datetime64 array of hour starts and ``values`` the matching
+    AQI values with NaN for offline hours. Offline hours and hours of the day
+    outside [hour_from, hour_to] are dropped. Columns match the dict records
+    the API has always returned.
+    """
+    hours = np.asarray(hours, dtype='datetime64[h]')
+    values = np.asarray(values, dtype=float)
+
+    hour_of_day = (hours - hours.astype('datetime64[D]')).astype(np.int64)
+    keep = ~np.isnan(values) & (hour_of_day >= hour_from) & (hour_of_day <= hour_to)
+    hours, values, hour_of_day = hours[keep], values[keep], hour_of_day[keep]
+
+    days = hours.astype('datetime64[D]')
+    date_strings = np.datetime_as_string(days).astype(object)
+    # 1970-01-01 was a Thursday
+    day_of_week = DAY_NAMES[(days.astype(np.int64) + 3) % 7]
+    hours_ago = (np.datetime64(current_hour, 'h') - hours).astype(np.int64)
+
+    # Keep whole-number readings integral so CSV/JSON look like the upstream values
+    if len(values) and np.all(np.mod(values, 1) == 0):
+        aqi = values.astype(np.int64)
+    else:
+        aqi = values
+
+    n = len(hours)
+    return pd.DataFrame({
+        'mac': np.full(n, mac, dtype=object),
+        'timestamp': np.datetime_as_string(hours, unit='s').astype(object) + 'Z',
+        'date': date_strings,
+        'time': HOUR_TIMES[hour_of_day],
+        'hour': hour_of_day,
+        'day_of_week': day_of_week,
+        'aqi': aqi,
+        'calculatedAqi': aqi,
+        'aqi_level': aqi_levels(values),
+        'measurement_type': np.full(n, measurement_type, dtype=object),
+        'data_source': np.full(n, data_source, dtype=object),
+        'location': np.full(n, context['location'], dtype=object),
+        'latitude': np.full(n, context['latitude'], dtype=float),
+        'longitude': np.full(n, context['longitude'], dtype=float),
+        'hours_ago': hours_ago,
+        'real_timestamp': np.ones(n, dtype=bool),
+        'note': f'{note_prefix} from ' + date_strings + ' ' + HOUR_LABELS[hour_of_day]
+    }, columns=HOURLY_COLUMNS)
+
+
+def period_starts(hours, period):
+    """First day of the day or ISO week (starting Monday) each hour falls in"""
+    days = np.asarray(hours, dtype='datetime64[h]').astype('datetime64[D]')
+    if period == 'week':
+        # 1970-01-01 was a Thursday
+        days = days - (days.astype(np.int64) + 3) % 7
+    return days
+
+
+def rollup_frame(mac, hours, values, start_hour, end_hour, period='day',
+                 location=None, hour_from=0, hour_to=23):
+    """Aggregate hourly AQI values into one row per day or week
+
+    ``hours``/``values`` are what the store holds for [start_hour, end_hour]
+    (NaN for offline hours). Coverage is the share of the period's hours in
+    that range, restricted to hours of the day in [hour_from, hour_to], that
+    have a reading; periods without any reading are still listed.
+    """
+    if period not in ROLLUP_PERIODS:
+        raise ValueError(f"Unsupported period '{period}'. Use day or week")
+
+    expected = np.arange(np.datetime64(start_hour, 'h'), np.datetime64(end_hour, 'h') + 1)
+    expected = expected[_in_hours_of_day(expected, hour_from, hour_to)]
+    expected_counts = pd.Series(period_starts(expected, period)).value_counts().sort_index()
+
+    hours = np.asarray(hours, dtype='datetime64[h]')
+    values = np.asarray(values, dtype=float)
+    keep = ~np.isnan(values) & _in_hours_of_day(hours, hour_from, hour_to)
+    readings = pd.DataFrame({
+        'period_start': period_starts(hours[keep], period),
+        'aqi': values[keep],
+        'level': aqi_levels(values[keep])
+    })
+
+    grouped = readings.groupby('period_start')['aqi']
+    stats = grouped.agg(['count', 'mean', 'min', 'max'])
+    stats['p95'] = grouped.quantile(0.95)
+    levels = pd.crosstab(readings['period_start'], readings['level'])
+
+    index = expected_counts.index
+    stats = stats.reindex(index)
+    levels = levels.reindex(index=index, columns=AQI_LEVELS[:-1], fill_value=0).fillna(0)
+    count = stats['count'].fillna(0).astype(np.int64)
+
+    df = pd.DataFrame({
+        'mac': mac,
+        'period': period,
+        'period_start': np.datetime_as_string(index.values.astype('datetime64[D]')).astype(object),
+        'location': location,
+        'readings': count.values,
+        'expected_hours': expected_counts.values.astype(np.int64),
+        'coverage': (count.values / expected_counts.values).round(3),
+        'aqi_mean': stats['mean'].round(1).values,
+        'aqi_min': stats['min'].values,
+        'aqi_max': stats['max'].values,
+        'aqi_p95': stats['p95'].round(1).values
+    })
+    for column, level in zip(LEVEL_COLUMNS, AQI_LEVELS[:-1]):
+        df[column] = levels[level].values.astype(np.int64)
+    return df[ROLLUP_COLUMNS]
+
+
+def _in_hours_of_day(hours, hour_from, hour_to):
+    hour_of_day = (hours - hours.astype('datetime64[D]')).astype(np.int64)
+    return (hour_of_day >= hour_from) & (hour_of_day <= hour_to)
+
+
+def empty_rollup_frame():
+    return pd.DataFrame(columns=ROLLUP_COLUMNS)
+
+
+def parse_export_format(fmt, compression=None):
+    """Validate a format/compression pair; returns (format, compression) or raises ValueError"""
+    fmt = (fmt or 'csv').lower()
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported format '{fmt}'. Use csv, parquet or feather")
+    if fmt == 'csv':
+        return fmt, None
+
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ValueError(f"{fmt} export requires the pyarrow package")
+
+    compression = (compression or DEFAULT_COMPRESSION[fmt]).lower()
+    if compression not in COMPRESSIONS[fmt]:
+        raise ValueError(f"Unsupported {fmt} compression '{compression}'. Use one of: {', '.join(COMPRESSIONS[fmt])}")
+    return fmt, compression
+
+
+def typed_frame(df):
+    """Give exported columns real types: UTC timestamps, float AQI, categoricals"""
+    df = df.copy()
+    for col, fmt in DATETIME_FORMATS.items():
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], format=fmt, utc=True, errors='coerce')
+    for col in FLOAT_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    return df
+
+
+def frame_to_bytes(df, fmt, compression=None):
+    """Serialize a frame as a whole file in a columnar format"""
+    if fmt not in ('parquet', 'feather'):
+        raise ValueError(f"Unsupported format '{fmt}'")
+
+    buffer = io.BytesIO()
+    with timed('serialize', CONVERSION_SECONDS, format=fmt):
+        df = typed_frame(df).reset_index(drop=True)
+        if fmt == 'parquet':
+            df.to_parquet(buffer, engine='pyarrow', compression=None if compression == 'none' else compression, index=False)
+        else:
+            df.to_feather(buffer, compression=compression)
+    return buffer.getvalue()
+
+
+def empty_hourly_frame():
+    return pd.DataFrame(columns=HOURLY_COLUMNS)
+
+
+def records_frame(records):
+    """Build a frame from JSON records (dicts), or None if there are none
+
+    Records in one of the API's own shapes become those columns as they are,
+    matching the frame they were made from. Anything else, such as upstream
+    readings whose fields vary by device, is built column by column: nested
+    objects become ``parent_child`` columns and lists are kept as their text.
+    Datetime columns are parsed with an explicit format and left as text if
+    any value does not fit it.
+    """
+    records = [record for record in records if isinstance(record, dict)]
+    if not records:
+        return None
+
+    columns = RECORD_SCHEMAS.get(frozenset(records[0]))
+    if columns is not None and all(len(record) == len(columns) for record in records):
+        return pd.DataFrame.from_records(records, columns=columns)
+
+    df = pd.DataFrame(_flat_columns(pd.DataFrame(records)), index=range(len(records)))
+    for col, fmt in DATETIME_FORMATS.items():
+        if col in df.columns:
+            try:
+                df[col] = pd.to_datetime(df[col], format=fmt)
+            except (ValueError, TypeError):
+                pass
+    return df
+
+
+def _flat_columns(df, prefix=''):
+    """{name: values} with columns holding objects expanded in place into parent_child columns"""
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        name = f'{prefix}{col}'
+        if values.dtype != object:
+            columns[name] = values.to_numpy()
+            continue
+
+        kinds = values.map(type)
+        is_dict = kinds == dict
+        if is_dict.any():
+            if values[~is_dict].notna().any():
+                # Keeps the plain values of a key that is an object only in some records
+                columns[name] = values.where(~is_dict).to_numpy()
+            nested = pd.DataFrame([value if type(value) is dict else {} for value in values])
+            columns.update(_flat_columns(nested, f'{name}_'))
+            continue
+
+        is_list = kinds == list
+        if is_list.any():
+            values = values.where(~is_list, values[is_list].astype(str))
+        columns[name] = values.to_numpy()
+    return columns
+
+
+def frame_to_records(df):
+    """List-of-dicts view of a frame, with native Python values"""
+    return df.to_dict(orient='records')
+
+
+def frame_to_json(df):
+    """Serialize a frame straight to a JSON array of records"""
+    return df.to_json(orient='records', force_ascii=False)
+
+
+def preview_payload(df, offset=0, limit=None, fields=None, compact=False, coverage=None):
+    """JSON body for one page of a preview
+
+    ``fields`` projects to a subset of columns. In compact form, columns that
+    hold a single value over the whole result (location, coordinates, ...)
+    are sent once under ``constants`` and the page goes out as ``columns`` +
+    ``rows`` arrays instead of repeating every key in every record.
+    ``coverage`` (hour counts of the stored window) is passed through as is.
+    """
+    if fields:
+        df = df[[col for col in fields if col in df.columns]]
+
+    total = len(df)
+    page = df.iloc[offset:offset + limit] if limit is not None else df.iloc[offset:]
+    next_offset = offset + len(page)
+    meta = {
+        'success': True,
+        'total_records': total,
+        'offset': offset,
+        'limit': limit,
+        'next_offset': next_offset if next_offset < total else None
+    }
+    if coverage is not None:
+        meta['coverage'] = coverage
+    head = json.dumps(meta)[:-1]
+
+    if not compact:
+        return f'{head}, "data": {frame_to_json(page)}}}'
+
+    constant = [col for col in df.columns if total and df[col].astype(str).nunique(dropna=False) == 1]
+    varying = [col for col in df.columns if col not in constant]
+    constants_json = df[constant].iloc[:1].to_json(orient='records', force_ascii=False)[1:-1] if constant else ''
+    return (
+        f'{head}, "constants": {constants_json or "{}"}, '
+        f'"columns": {json.dumps(varying)}, '
+        f'"rows": {page[varying].to_json(orient="values", force_ascii=False)}}}'
+    )
+
+
+def iter_csv(frames, chunk_rows=5000):
+    """Yield CSV text for a sequence of frames, header first, chunk by chunk
+
+    Frames may be produced lazily (e.g. one per device); columns are taken
+    from the first non-empty frame and later frames are aligned to them.
+    """
+    columns = None
+    elapsed = 0.0
+    for df in frames:
+        if df is None or len(df) == 0:
+            continue
+        if columns is None:
+            columns = list(df.columns)
+            yield df.iloc[:0].to_csv(index=False)
+        else:
+            df = df.reindex(columns=columns)
+        for start in range(0, len(df), chunk_rows):
+            started = time.perf_counter()
+            chunk = df.iloc[start:start + chunk_rows].to_csv(index=False, header=False)
+            elapsed += time.perf_counter() - started
+            yield chunk
+    # Time spent writing CSV only, not waiting for frames or the client
+    CONVERSION_SECONDS.observe(elapsed, format='csv')
+
+
+class _ChunkBuffer:
+    """Write-only, non-seekable sink that hands out what was written so far"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(named_frames, fmt='csv', compression=None, chunk_rows=5000):
+    """Yield a ZIP archive with one file per (filename, frame), as frames arrive"""
+    sink = _ChunkBuffer()
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, df in named_frames:
+            if df is None or len(df) == 0:
+                continue
+            if fmt != 'csv':
+                # Columnar files are already compressed; store them as-is
+                archive.writestr(name, frame_to_bytes(df, fmt, compression), compress_type=zipfile.ZIP_STORED)
+                yield sink.drain()
+                continue
+            with archive.open(name, mode='w') as member:
+                for chunk in iter_csv([df], chunk_rows):
+                    member.write(chunk.encode('utf-8'))
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,203 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, every process ingests
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionScheduler:
+    """Polls every saved device in the background and writes to the local caches
+
+    Each device is refreshed every ``interval`` seconds (+/- ``jitter``), at
+    most ``max_workers`` at a time, fetching only the part of its last
+    ``hours`` hours that the store does not cover yet. A device that keeps
+    failing backs off exponentially up to ``max_backoff`` seconds so dead
+    sensors don't eat the pool. Under gunicorn every worker imports the app,
+    so a lock file makes sure only one process actually polls. After each
+    poll, failed ones included, the device's newly closed hours go to the
+    ``alerts`` engine, if one is given.
+    """
+
+    def __init__(self, api, interval=300, hours=48, max_workers=4, jitter=0.1,
+                 max_backoff=3600, lock_file=None, alerts=None):
+        self.api = api
+        self.alerts = alerts
+        self.interval = interval
+        self.hours = hours
+        self.max_workers = max_workers
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.lock_file = lock_file
+
+        self._devices = {}
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_fd = None
+        self._executor = None
+
+    def _acquire_lock(self):
+        if not self.lock_file or fcntl is None:
+            return True
+        fd = open(self.lock_file, 'w')
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fd.close()
+            return False
+        self._lock_fd = fd
+        return True
+
+    def start(self):
+        """Start polling in a daemon thread; returns False if another process polls"""
+        if self._thread is not None:
+            return True
+        if not self._acquire_lock():
+            logger.info("Ingestion scheduler already running in another process")
+            return False
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ingest')
+        self._thread = threading.Thread(target=self._run, name='ingest-scheduler', daemon=True)
+        self._thread.start()
+        logger.info("Ingestion scheduler started: every %ss, %s workers", self.interval, self.max_workers)
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._lock_fd is not None:
+            self._lock_fd.close()
+            self._lock_fd = None
+
+    def run_forever(self):
+        """Poll in the foreground (sidecar mode) until interrupted"""
+        if not self.start():
+            return
+        try:
+            while self._thread is not None and self._thread.is_alive():
+                self._thread.join(timeout=1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._sync_devices()
+                self._dispatch_due()
+            except Exception as e:
+                logger.exception("Ingestion scheduler error: %s", e)
+            self._stop.wait(self._seconds_until_next())
+
+    def _sync_devices(self):
+        """Pick up devices added or removed since the last pass"""
+        macs = {device['mac'] for device in self.api.get_saved_devices() if device.get('mac')}
+        now = time.monotonic()
+        with self._lock:
+            for mac in macs - set(self._devices):
+                # Spread the first polls out instead of stampeding on startup
+                self._devices[mac] = {
+                    'next_due': now + random.uniform(0, self.interval * self.jitter),
+                    'failures': 0,
+                    'last_success': None,
+                    'last_error': None,
+                    'hours_fetched': None
+                }
+            for mac in set(self._devices) - macs:
+                del self._devices[mac]
+
+    def _dispatch_due(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                mac for mac, state in self._devices.items()
+                if state['next_due'] <= now and mac not in self._in_flight
+            ]
+            self._in_flight.update(due)
+        for mac in due:
+            self._executor.submit(self._poll, mac)
+
+    def _seconds_until_next(self):
+        with self._lock:
+            pending = [
+                state['next_due'] for mac, state in self._devices.items()
+                if mac not in self._in_flight
+            ]
+        if not pending:
+            return min(self.interval, 5)
+        return min(max(min(pending) - time.monotonic(), 0.5), self.interval)
+
+    def _poll(self, mac):
+        try:
+            ok, fetched = self.api.refresh_device(mac, self.hours)
+            error = None if ok else 'no data returned'
+        except Exception as e:
+            ok, fetched, error = False, 0, str(e)
+
+        with self._lock:
+            self._in_flight.discard(mac)
+            state = self._devices.get(mac)
+            if state is None:
+                return
+            state['hours_fetched'] = fetched
+            if ok:
+                state['failures'] = 0
+                state['last_success'] = datetime.now().isoformat()
+                state['last_error'] = None
+                delay = self.interval
+            else:
+                state['failures'] += 1
+                state['last_error'] = error
+                delay = min(self.interval * 2 ** state['failures'], self.max_backoff)
+            delay *= 1 + random.uniform(-self.jitter, self.jitter)
+            state['next_due'] = time.monotonic() + delay
+
+        if error:
+            logger.warning("Ingestion of %s failed (%s)", mac, error)
+        # Also after a failed poll: hours that never arrived count toward silence rules
+        if self.alerts is not None:
+            try:
+                self.alerts.update(mac, self.api.history)
+            except Exception as e:
+                logger.warning("Alert evaluation for %s failed: %s", mac, e)
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            devices = {
+                mac: {
+                    'failures': state['failures'],
+                    'last_success': state['last_success'],
+                    'last_error': state['last_error'],
+                    'hours_fetched': state['hours_fetched'],
+                    'next_poll_in': round(max(state['next_due'] - now, 0), 1),
+                    'in_flight': mac in self._in_flight
+                }
+                for mac, state in self._devices.items()
+            }
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'interval': self.interval,
+            'devices': devices
+        }
+
+
+if __name__ == '__main__':
+    # Sidecar mode: python scheduler.py (with INGEST_ENABLED unset in the web app)
+    from app import scheduler
+    scheduler.run_forever()
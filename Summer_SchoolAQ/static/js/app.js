@@ -2,16 +2,20 @@
 // Global variables
 let currentDeviceData = null;
 let testInProgress = false;
+let previewNextOffset = null;
+let previewColumns = null;
+const PREVIEW_PAGE_SIZE = 200;
 
 // Show/hide time inputs based on data type selection
 document.querySelectorAll('input[name="data_type"]').forEach(radio => {
     radio.addEventListener('change', function() {
         const timeInputs = document.getElementById('timeInputs');
-        if (this.value === 'time_range') {
+        if (this.value === 'time_range' || this.value === 'rollup') {
             timeInputs.classList.add('show');
         } else {
             timeInputs.classList.remove('show');
         }
+        document.getElementById('periodInput').style.display = this.value === 'rollup' ? 'block' : 'none';
     });
 });
 
@@ -76,7 +80,7 @@ function validateForm() {
         return false;
     }
     
-    if (dataType === 'time_range') {
+    if (dataType === 'time_range' || dataType === 'rollup') {
         const startDate = document.getElementById('start_date').value;
         const endDate = document.getElementById('end_date').value;
         const hoursFrom = document.getElementById('hours_from').value;
@@ -380,14 +384,8 @@ function formatCellValue(key, value) {
     return value;
 }
 
-// Enhanced data preview table creation
-function createPreviewTable(data) {
-    if (!data || data.length === 0) {
-        return '<div style="text-align: center; padding: 40px; color: #666;">📊 No data available</div>';
-    }
-    
-    const sample = data[0];
-    
+// Columns shown in the preview table, picked from a sample record
+function selectPreviewColumns(sample) {
     // Priority fields for display with location
     const priorityFields = [
         'mac', 'timestamp', 'date', 'time', 'location', 'latitude', 'longitude', 'alt', 
@@ -413,6 +411,15 @@ function createPreviewTable(data) {
         }
     });
     
+    return selectedKeys;
+}
+
+// Enhanced data preview table creation
+function createPreviewTable(data, selectedKeys) {
+    if (!data || data.length === 0) {
+        return '<div style="text-align: center; padding: 40px; color: #666;">📊 No data available</div>';
+    }
+    
     let html = '<div style="overflow-x: auto;"><table class="preview-table"><thead><tr>';
     
     selectedKeys.forEach(key => {
@@ -420,7 +427,14 @@ function createPreviewTable(data) {
         html += `<th>${displayName}</th>`;
     });
     html += '</tr></thead><tbody>';
-    
+    html += createPreviewRows(data, selectedKeys);
+    html += '</tbody></table></div>';
+    return html;
+}
+
+// Table rows for preview records
+function createPreviewRows(data, selectedKeys) {
+    let html = '';
     data.forEach(row => {
         html += '<tr>';
         selectedKeys.forEach(key => {
@@ -436,8 +450,6 @@ function createPreviewTable(data) {
         });
         html += '</tr>';
     });
-    
-    html += '</tbody></table></div>';
     return html;
 }
 
@@ -462,6 +474,72 @@ function getAqiColor(level) {
     return '';
 }
 
+// Expand a compact preview page (constants + columns/rows) back into records
+function expandPreviewPage(result) {
+    if (!result.rows) {
+        return result.data;
+    }
+    
+    return result.rows.map(row => {
+        const record = {};
+        result.columns.forEach((column, i) => {
+            record[column] = row[i];
+        });
+        return Object.assign(record, result.constants);
+    });
+}
+
+// Summarize which hours of the requested window the server has data for
+function formatCoverage(coverage) {
+    if (!coverage || !coverage.hours) {
+        return '';
+    }
+    
+    const known = coverage.good + coverage.offline + coverage.provisional;
+    let text = ` · ${Math.round(100 * known / coverage.hours)}% of ${coverage.hours} hours fetched`;
+    const details = [];
+    if (coverage.offline) details.push(`${coverage.offline} offline`);
+    if (coverage.unfetched) details.push(`${coverage.unfetched} unavailable`);
+    if (details.length) text += ` (${details.join(', ')})`;
+    return text;
+}
+
+// Fetch one page of the preview and append it to the table
+async function loadPreviewPage(offset) {
+    // GET so repeated previews can be answered by the browser cache or a 304
+    const params = new URLSearchParams(new FormData(document.getElementById('dataForm')));
+    params.append('offset', offset);
+    params.append('limit', PREVIEW_PAGE_SIZE);
+    params.append('compact', '1');
+    
+    const response = await fetch(`/preview_data?${params}`);
+    
+    const result = await response.json();
+    
+    if (!result.success) {
+        throw new Error(result.error || 'Failed to load data preview');
+    }
+    
+    const page = expandPreviewPage(result);
+    currentDeviceData = offset === 0 ? page : currentDeviceData.concat(page);
+    
+    const previewContent = document.getElementById('previewContent');
+    const tbody = previewContent.querySelector('tbody');
+    if (offset === 0 || !tbody) {
+        previewColumns = currentDeviceData.length ? selectPreviewColumns(currentDeviceData[0]) : null;
+        previewContent.innerHTML = createPreviewTable(currentDeviceData, previewColumns);
+    } else {
+        // Only the new page's rows are built; the rows already shown stay as they are
+        tbody.insertAdjacentHTML('beforeend', createPreviewRows(page, previewColumns));
+    }
+    previewNextOffset = result.next_offset;
+    
+    const recordCount = document.getElementById('recordCount');
+    const loadMoreBtn = document.getElementById('loadMoreBtn');
+    recordCount.textContent = `📊 Showing ${currentDeviceData.length} of ${result.total_records} records` + formatCoverage(result.coverage);
+    loadMoreBtn.style.display = previewNextOffset === null ? 'none' : 'inline-block';
+}
+
 // Preview data functionality
 document.getElementById('previewBtn').addEventListener('click', async function() {
     if (!validateForm()) return;
@@ -469,44 +547,46 @@ document.getElementById('previewBtn').addEventListener('click', async function()
     clearAlerts();
     showLoading(true, 'Loading data preview...');
     
-    const formData = new FormData(document.getElementById('dataForm'));
-    
     try {
-        const response = await fetch('/preview_data', {
-            method: 'POST',
-            body: formData
-        });
+        await loadPreviewPage(0);
         
-        const result = await response.json();
+        const previewSection = document.getElementById('previewSection');
+        previewSection.classList.add('show');
         
-        if (result.success) {
-            const previewSection = document.getElementById('previewSection');
-            const previewContent = document.getElementById('previewContent');
-            const recordCount = document.getElementById('recordCount');
-            
-            currentDeviceData = result.data;
-            recordCount.textContent = `📊 Showing ${result.data.length} of ${result.total_records} records`;
-            previewContent.innerHTML = createPreviewTable(result.data);
-            previewSection.classList.add('show');
-            
-            // Scroll to preview
-            previewSection.scrollIntoView({ behavior: 'smooth' });
-            
-            showAlert('Data preview loaded successfully! Review the data below.', 'success');
-        } else {
-            showAlert(result.error || 'Failed to load data preview', 'error');
-        }
+        // Scroll to preview
+        previewSection.scrollIntoView({ behavior: 'smooth' });
+        
+        showAlert('Data preview loaded successfully! Review the data below.', 'success');
     } catch (error) {
-        showAlert('Network error occurred while loading preview', 'error');
+        showAlert(error.message || 'Network error occurred while loading preview', 'error');
     } finally {
         showLoading(false);
     }
 });
 
+// Load the next preview page
+document.getElementById('loadMoreBtn').addEventListener('click', async function() {
+    if (previewNextOffset === null) return;
+    
+    this.disabled = true;
+    this.textContent = '🔄 Loading...';
+    
+    try {
+        await loadPreviewPage(previewNextOffset);
+    } catch (error) {
+        showAlert(error.message || 'Network error occurred while loading preview', 'error');
+    } finally {
+        this.disabled = false;
+        this.textContent = '⬇️ Load more';
+    }
+});
+
 // Close preview functionality
 document.getElementById('closePreviewBtn').addEventListener('click', function() {
     document.getElementById('previewSection').classList.remove('show');
     currentDeviceData = null;
+    previewNextOffset = null;
+    previewColumns = null;
 });
 
 // Download data functionality
@@ -516,13 +596,10 @@ document.getElementById('downloadBtn').addEventListener('click', async function(
     clearAlerts();
     showLoading(true, 'Preparing download...');
     
-    const formData = new FormData(document.getElementById('dataForm'));
+    const params = new URLSearchParams(new FormData(document.getElementById('dataForm')));
     
     try {
-        const response = await fetch('/download_data', {
-            method: 'POST',
-            body: formData
-        });
+        const response = await fetch(`/download_data?${params}`);
         
         if (response.ok) {
             const blob = await response.blob();
@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+# app builds its stores at import time; keep them out of the working directory
+_workdir = tempfile.mkdtemp(prefix='aq-tests-')
+os.environ.update({
+    'HISTORY_DB': os.path.join(_workdir, 'history.sqlite3'),
+    'GEOCODE_CACHE_DB': os.path.join(_workdir, 'geocode.sqlite3'),
+    'DEVICES_DB': os.path.join(_workdir, 'devices.sqlite3'),
+    'LEGACY_DEVICES_FILE': os.path.join(_workdir, 'saved_devices.json'),
+    'INGEST_LOCK_FILE': os.path.join(_workdir, 'ingest.lock'),
+    'EXPORT_CACHE_DIR': os.path.join(_workdir, 'export_cache'),
+    'INGEST_ENABLED': '0',
+    'LOG_LEVEL': 'ERROR'
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
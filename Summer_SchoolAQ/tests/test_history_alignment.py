@@ -0,0 +1,97 @@
+"""A 24h series is labelled by the hour it was requested in, not the hour it arrived in"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import app
+import timeseries
+from timeseries import HourlyStore
+
+MAC = 'aa:bb:cc:dd:ee:ff'
+CONTEXT = {'latest': {'aqi': 1}, 'location': 'Test', 'latitude': None, 'longitude': None}
+
+
+class FakeClock:
+    """Stands in for datetime in app and timeseries; now() returns whatever was set last"""
+
+    def __init__(self, now):
+        self.value = now
+
+    def now(self):
+        return self.value
+
+    def __getattr__(self, name):
+        return getattr(datetime, name)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock(datetime(2025, 3, 1, 10, 59, 59))
+    monkeypatch.setattr(app, 'datetime', clock)
+    monkeypatch.setattr(timeseries, 'datetime', clock)
+    return clock
+
+
+@pytest.fixture
+def api(tmp_path, clock):
+    return app.AirQualityAPI(
+        'http://upstream.invalid',
+        history=HourlyStore(str(tmp_path / 'history.sqlite3')),
+        devices=app.DeviceRegistry(str(tmp_path / 'devices.sqlite3'))
+    )
+
+
+def fake_fetch(api, monkeypatch, clock, arrives_at):
+    """Answer the 24h fetch with 1, 2, ... and move the clock to arrives_at while it is in flight"""
+    requested = []
+
+    def fetch(mac, hours, refresh=False):
+        requested.append(hours)
+        clock.value = arrives_at
+        return [float(i) for i in range(1, hours + 1)], CONTEXT
+
+    monkeypatch.setattr(api, '_fetch_24h_with_context', fetch)
+    monkeypatch.setattr(api, 'get_device_context', lambda mac, refresh=False: CONTEXT)
+    return requested
+
+
+def stored(api, start, end):
+    hours, values = api.history.read_range(MAC, start, end)
+    return {str(hour): value for hour, value in zip(hours, values)}
+
+
+def test_series_that_arrives_in_the_same_hour_ends_at_it(api, monkeypatch, clock):
+    ten = datetime(2025, 3, 1, 10)
+    fake_fetch(api, monkeypatch, clock, arrives_at=datetime(2025, 3, 1, 10, 59, 59, 900000))
+
+    api._ensure_history(MAC, ten - timedelta(hours=2), ten)
+
+    assert stored(api, ten - timedelta(hours=2), ten + timedelta(hours=1)) == {
+        '2025-03-01T08': 1.0, '2025-03-01T09': 2.0, '2025-03-01T10': 3.0
+    }
+
+
+def test_series_that_arrives_after_the_hour_changed_is_not_stored(api, monkeypatch, clock):
+    ten = datetime(2025, 3, 1, 10)
+    requested = fake_fetch(api, monkeypatch, clock, arrives_at=datetime(2025, 3, 1, 11, 0, 1))
+
+    context = api._ensure_history(MAC, ten - timedelta(hours=2), ten)
+
+    # Sized from the hour before the request: 08:00 through 10:00
+    assert requested == [3]
+    assert context is CONTEXT
+    # Labelled from 11:00 every value would land an hour late
+    assert stored(api, ten - timedelta(hours=3), ten + timedelta(hours=1)) == {}
+
+
+def test_refresh_across_the_boundary_reports_no_hours(api, monkeypatch, clock):
+    fake_fetch(api, monkeypatch, clock, arrives_at=datetime(2025, 3, 1, 11, 0, 1))
+
+    assert api.refresh_device(MAC, 3) == (True, 0)
+
+    # The next poll, within 11:00, fetches and stores the window again
+    assert api.refresh_device(MAC, 3) == (True, 3)
+    eleven = datetime(2025, 3, 1, 11)
+    assert stored(api, eleven - timedelta(hours=2), eleven) == {
+        '2025-03-01T09': 1.0, '2025-03-01T10': 2.0, '2025-03-01T11': 3.0
+    }
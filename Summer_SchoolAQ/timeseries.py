@@ -0,0 +1,302 @@
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+
+HOUR_FORMAT = '%Y-%m-%d %H:00'
+# What the store knows about an hour, by coverage code
+COVERAGE_STATES = ('unfetched', 'good', 'offline', 'provisional')
+
+
+def floor_hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+class HourlyStore:
+    """Local SQLite store of hourly AQI values per device
+
+    One row per (device, hour). Hours the upstream reported as -1 are kept
+    with a NULL value so "sensor offline" can be told apart from "never
+    fetched" when deciding what still has to come from the airview API.
+    The hour that is still in progress is stored as provisional (final=0)
+    and counts as missing once it is older than ``provisional_ttl`` seconds,
+    until it is fetched again after it has closed.
+
+    The latest raw reading per device is kept alongside so that every worker
+    process can reuse what the ingestion scheduler fetched, as are daily
+    rollups of closed days, which are dropped whenever a merge touches the day.
+    """
+
+    def __init__(self, db_path, provisional_ttl=0):
+        self.db_path = db_path
+        self.provisional_ttl = provisional_ttl
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        # WAL makes NORMAL durable enough and avoids an fsync per commit
+        conn.execute('PRAGMA synchronous=NORMAL')
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS hourly_aqi ('
+                ' mac TEXT NOT NULL,'
+                ' hour TEXT NOT NULL,'
+                ' aqi REAL,'
+                ' final INTEGER NOT NULL,'
+                ' ingested_at REAL NOT NULL,'
+                ' PRIMARY KEY (mac, hour)) WITHOUT ROWID'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS latest_reading ('
+                ' mac TEXT PRIMARY KEY,'
+                ' payload TEXT NOT NULL,'
+                ' fetched_at REAL NOT NULL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS daily_rollup ('
+                ' mac TEXT NOT NULL,'
+                ' day TEXT NOT NULL,'
+                ' payload TEXT NOT NULL,'
+                ' PRIMARY KEY (mac, day)) WITHOUT ROWID'
+            )
+
+    @staticmethod
+    def _key(mac):
+        return mac.lower()
+
+    def merge(self, mac, values, end_hour):
+        """Merge an upstream 24h series (oldest first, last value at end_hour)"""
+        end_hour = floor_hour(end_hour)
+        current_hour = floor_hour(datetime.now())
+        now = time.time()
+        rows = []
+        for i, value in enumerate(values):
+            hour = end_hour - timedelta(hours=len(values) - 1 - i)
+            aqi = None if value is None or value == -1 else float(value)
+            rows.append((self._key(mac), hour.strftime(HOUR_FORMAT), aqi, int(hour < current_hour), now))
+
+        if rows:
+            with self._connect() as conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO hourly_aqi (mac, hour, aqi, final, ingested_at) VALUES (?, ?, ?, ?, ?)',
+                    rows
+                )
+                conn.execute(
+                    'DELETE FROM daily_rollup WHERE mac = ? AND day BETWEEN ? AND ?',
+                    (self._key(mac), rows[0][1][:10], rows[-1][1][:10])
+                )
+        return len(rows)
+
+    def read_range(self, mac, start_hour, end_hour):
+        """Return (hours, values) arrays stored between two hours inclusive
+
+        ``hours`` is datetime64[h], ``values`` float with NaN for offline hours.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT hour, aqi FROM hourly_aqi WHERE mac = ? AND hour BETWEEN ? AND ? ORDER BY hour',
+                (self._key(mac), start_hour.strftime(HOUR_FORMAT), end_hour.strftime(HOUR_FORMAT))
+            ).fetchall()
+        if not rows:
+            return np.array([], dtype='datetime64[h]'), np.array([], dtype=float)
+        hours, values = zip(*rows)
+        return (
+            np.array(hours, dtype='datetime64[m]').astype('datetime64[h]'),
+            np.array(values, dtype=float)
+        )
+
+    def first_missing_hour(self, mac, start_hour, end_hour):
+        """Earliest hour in [start_hour, end_hour] without a final stored row, or None"""
+        start_hour, end_hour = floor_hour(start_hour), floor_hour(end_hour)
+        if start_hour > end_hour:
+            return None
+
+        with self._connect() as conn:
+            stored = {
+                row[0] for row in conn.execute(
+                    'SELECT hour FROM hourly_aqi WHERE mac = ? AND hour BETWEEN ? AND ?'
+                    ' AND (final = 1 OR ingested_at >= ?)',
+                    (self._key(mac), start_hour.strftime(HOUR_FORMAT), end_hour.strftime(HOUR_FORMAT),
+                     time.time() - self.provisional_ttl)
+                )
+            }
+
+        expected = int((end_hour - start_hour).total_seconds() // 3600) + 1
+        if len(stored) >= expected:
+            return None
+
+        hour = start_hour
+        while hour <= end_hour:
+            if hour.strftime(HOUR_FORMAT) not in stored:
+                return hour
+            hour += timedelta(hours=1)
+        return None
+
+    def window_stats(self, mac, start_hour, end_hour):
+        """(rows, provisional rows, last ingestion time or None) stored between two hours"""
+        with self._connect() as conn:
+            rows, provisional, ingested_at = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(final = 0), 0), MAX(ingested_at) FROM hourly_aqi'
+                ' WHERE mac = ? AND hour BETWEEN ? AND ?',
+                (self._key(mac), start_hour.strftime(HOUR_FORMAT), end_hour.strftime(HOUR_FORMAT))
+            ).fetchone()
+        return rows, provisional, ingested_at
+
+    def coverage(self, mac, start_hour, end_hour, gaps=False):
+        """Hours between two hours inclusive counted by what the store knows about them
+
+        ``good`` hours have a reading, ``offline`` ones were reported as -1,
+        ``provisional`` ones are open hours stored before they closed and
+        ``unfetched`` ones were never fetched. With ``gaps``, the runs of
+        offline and unfetched hours are listed too, oldest first.
+        """
+        start_hour, end_hour = floor_hour(start_hour), floor_hour(end_hour)
+        hours = max(int((end_hour - start_hour).total_seconds() // 3600) + 1, 0)
+        span = (self._key(mac), start_hour.strftime(HOUR_FORMAT), end_hour.strftime(HOUR_FORMAT))
+        with self._connect() as conn:
+            good, offline, provisional = conn.execute(
+                'SELECT COALESCE(SUM(final = 1 AND aqi IS NOT NULL), 0), COALESCE(SUM(final = 1 AND aqi IS NULL), 0),'
+                ' COALESCE(SUM(final = 0), 0) FROM hourly_aqi WHERE mac = ? AND hour BETWEEN ? AND ?',
+                span
+            ).fetchone()
+            rows = conn.execute(
+                'SELECT hour, CASE WHEN final = 0 THEN 3 WHEN aqi IS NULL THEN 2 ELSE 1 END'
+                ' FROM hourly_aqi WHERE mac = ? AND hour BETWEEN ? AND ?',
+                span
+            ).fetchall() if gaps and hours else None
+
+        result = {
+            'hours': hours,
+            'good': good,
+            'offline': offline,
+            'provisional': provisional,
+            'unfetched': hours - good - offline - provisional
+        }
+        if gaps:
+            result['gaps'] = self._gaps(start_hour, hours, rows or [])
+        return result
+
+    @staticmethod
+    def _gaps(start_hour, hours, rows):
+        """Runs of offline and unfetched hours as [{'state', 'from', 'to', 'hours'}]"""
+        states = np.zeros(hours, dtype=np.int8)
+        if rows:
+            stored, codes = zip(*rows)
+            offsets = (np.array(stored, dtype='datetime64[m]').astype('datetime64[h]') - np.datetime64(start_hour, 'h'))
+            states[offsets.astype(np.int64)] = codes
+
+        # A run starts wherever the state changes
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(states)) + 1)) if hours else np.array([], dtype=np.int64)
+        ends = np.append(starts[1:], hours) - 1
+        first = np.datetime64(start_hour, 'h')
+        return [
+            {
+                'state': COVERAGE_STATES[states[start]],
+                'from': (first + int(start)).astype(datetime).strftime(HOUR_FORMAT),
+                'to': (first + int(end)).astype(datetime).strftime(HOUR_FORMAT),
+                'hours': int(end - start + 1)
+            }
+            for start, end in zip(starts, ends)
+            if COVERAGE_STATES[states[start]] in ('unfetched', 'offline')
+        ]
+
+    def provisional_days(self, mac, start_hour, end_hour):
+        """Days ('YYYY-MM-DD') between two hours that still hold provisional rows"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT DISTINCT substr(hour, 1, 10) FROM hourly_aqi'
+                ' WHERE mac = ? AND hour BETWEEN ? AND ? AND final = 0',
+                (self._key(mac), start_hour.strftime(HOUR_FORMAT), end_hour.strftime(HOUR_FORMAT))
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def first_provisional_hour(self, mac, start_hour, end_hour):
+        """Earliest hour between two hours stored as provisional, or None"""
+        with self._connect() as conn:
+            hour = conn.execute(
+                'SELECT MIN(hour) FROM hourly_aqi WHERE mac = ? AND hour BETWEEN ? AND ? AND final = 0',
+                (self._key(mac), start_hour.strftime(HOUR_FORMAT), end_hour.strftime(HOUR_FORMAT))
+            ).fetchone()[0]
+        return datetime.strptime(hour, HOUR_FORMAT) if hour else None
+
+    def load_rollups(self, mac, first_day, last_day):
+        """Stored daily rollups between two 'YYYY-MM-DD' days, as {day: stats}"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT day, payload FROM daily_rollup WHERE mac = ? AND day BETWEEN ? AND ?',
+                (self._key(mac), first_day, last_day)
+            ).fetchall()
+        return {day: json.loads(payload) for day, payload in rows}
+
+    def save_rollups(self, mac, rollups, read_at):
+        """Store daily rollups given as {day: stats}, computed from rows read at ``read_at``
+
+        A day merged into after ``read_at`` is skipped, so a rollup computed
+        from rows that were replaced meanwhile is never stored.
+        """
+        if not rollups:
+            return
+        key = self._key(mac)
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO daily_rollup (mac, day, payload)'
+                ' SELECT ?, ?, ? WHERE NOT EXISTS ('
+                '  SELECT 1 FROM hourly_aqi WHERE mac = ? AND hour BETWEEN ? AND ? AND ingested_at > ?)',
+                [
+                    (key, day, json.dumps(stats), key, f'{day} 00:00', f'{day} 23:00', read_at)
+                    for day, stats in rollups.items()
+                ]
+            )
+
+    def latest_hour(self, mac):
+        """Most recent stored hour for a device, or None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT MAX(hour) FROM hourly_aqi WHERE mac = ?', (self._key(mac),)
+            ).fetchone()
+        return datetime.strptime(row[0], HOUR_FORMAT) if row and row[0] else None
+
+    def save_latest(self, mac, payload):
+        """Remember the latest raw reading fetched for a device"""
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO latest_reading (mac, payload, fetched_at) VALUES (?, ?, ?)',
+                (self._key(mac), json.dumps(payload), time.time())
+            )
+
+    def load_latest(self, mac, max_age):
+        """Latest raw reading if it was fetched within max_age seconds, else None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT payload FROM latest_reading WHERE mac = ? AND fetched_at >= ?',
+                (self._key(mac), time.time() - max_age)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def load_latest_many(self, macs, max_age):
+        """{lowercased mac: latest raw reading} for the devices fetched within max_age seconds"""
+        keys = sorted({self._key(mac) for mac in macs})
+        readings = {}
+        with self._connect() as conn:
+            # Stay well below SQLite's limit on bound parameters
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = conn.execute(
+                    f'SELECT mac, payload FROM latest_reading WHERE mac IN ({", ".join("?" * len(chunk))})'
+                    ' AND fetched_at >= ?',
+                    chunk + [time.time() - max_age]
+                ).fetchall()
+                readings.update((mac, json.loads(payload)) for mac, payload in rows)
+        return readings
@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from observability import UPSTREAM_IN_FLIGHT, UPSTREAM_RESPONSES, UPSTREAM_SECONDS
+
+
+class UpstreamClient:
+    """Connection-pooled HTTP client shared by all upstream calls"""
+
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=30,
+                 max_retries=2, backoff_factor=0.5):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+        self._latency = {}
+
+    def _build_session(self):
+        """Create a keep-alive session with bounded retries on 5xx and failed connects
+
+        Read timeouts are not retried: the sensor got the request and is
+        slow, and each retry would hold the caller for another full read
+        timeout (30s on the 24h endpoint).
+        """
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=0,
+            status=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @property
+    def session(self):
+        """Session for the current process (gunicorn workers must not share sockets)"""
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._lock:
+                if self._session is None or self._session_pid != pid:
+                    self._session = self._build_session()
+                    self._session_pid = pid
+                    self._latency = {}
+        return self._session
+
+    def get(self, url, endpoint, timeout=None, **kwargs):
+        """GET a URL and record its latency under the given endpoint name"""
+        read_timeout = timeout if timeout is not None else self.read_timeout
+        session = self.session
+        UPSTREAM_IN_FLIGHT.inc(endpoint=endpoint)
+        status = 'error'
+        start = time.perf_counter()
+        try:
+            response = session.get(url, timeout=(self.connect_timeout, read_timeout), **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            UPSTREAM_IN_FLIGHT.dec(endpoint=endpoint)
+            UPSTREAM_RESPONSES.inc(endpoint=endpoint, status=status)
+            self._record_latency(endpoint, time.perf_counter() - start)
+
+    def _record_latency(self, endpoint, seconds):
+        UPSTREAM_SECONDS.observe(seconds, endpoint=endpoint)
+        with self._lock:
+            stats = self._latency.setdefault(endpoint, {'count': 0, 'total': 0.0, 'max': 0.0})
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+
+    def latency_stats(self):
+        """Per-endpoint request count and latency in milliseconds"""
+        with self._lock:
+            return {
+                endpoint: {
+                    'count': stats['count'],
+                    'avg_ms': round(stats['total'] / stats['count'] * 1000, 1),
+                    'max_ms': round(stats['max'] * 1000, 1)
+                }
+                for endpoint, stats in self._latency.items()
+            }
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None